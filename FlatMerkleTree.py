@@ -0,0 +1,609 @@
+from MerkleHash import DIGEST_SIZE, get_hash_backend, hash_leaves, hash_level, hash_records
+from MerkleProof import MerkleProof, build_multiproof
+from MerkleTree import TreeNode, show_tree
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate
+from multiprocessing import shared_memory
+import logging
+import math
+import os
+import time
+
+'''
+创建一棵“扁平”的 Merkle 树
+
+与 MerkleTree 不同，这里不为每个节点创建 TreeNode 对象：
+每一层的 hash 值首尾相连地存放在一个 bytearray 中（每个 32 字节），
+第 level 层第 index 个节点的孩子就是第 level-1 层的 2*index 与 2*index+1。
+TreeNode 只在 show() / search() 需要画图的时候临时生成。
+'''
+
+logger = logging.getLogger(__name__)
+
+MIN_CHUNK = 2**10  # 多进程构建时，每个子进程至少负责的叶子数量
+OFFSET_SIZE = 8    # 共享内存中每个叶子偏移量的字节数（array('Q')）
+
+
+def build_subtree(inputName, realSize, shmName, offsets, start, stop, padDigest, hashName, batched):
+    '''
+    函数功能：（在子进程中）计算第 start ~ stop-1 个叶子组成的子树的每一层，写入共享内存
+    参数：inputName 为保存叶子数据的共享内存（见 share_leaves），子进程直接从中读取自己的叶子
+         offsets 为每一层在输出共享内存中的起始位置
+         第 realSize 个之后是补充的叶子（filling），使用 padDigest
+    '''
+    inputShm = shared_memory.SharedMemory(name=inputName)
+    shm = shared_memory.SharedMemory(name=shmName)
+    table = inputShm.buf[:OFFSET_SIZE * (realSize + 1)].cast('Q')
+    data = inputShm.buf[OFFSET_SIZE * (realSize + 1):]
+    try:
+        level = bytearray(hash_records(data, table, start, min(stop, realSize), hashName))
+        if padDigest != None:
+            level += padDigest * (stop - max(start, realSize))
+        for depth, offset in enumerate(offsets):
+            if depth > 0:
+                level = hash_level(level, hashName, batched)
+            position = offset + (start >> depth) * DIGEST_SIZE
+            shm.buf[position:position+len(level)] = level
+    finally:
+        table.release()
+        data.release()
+        inputShm.close()
+        shm.close()
+
+
+def share_leaves(leafData):
+    '''
+    函数功能：把叶子数据按 UTF-8 编码写入一块共享内存：len(leafData)+1 个 8 字节的偏移量，之后是首尾相连的数据
+    返回：共享内存（调用者负责 close / unlink）
+    '''
+    encoded = [data.encode('utf-8') for data in leafData]
+    table = array('Q', accumulate(map(len, encoded), initial=0))
+    tableSize = len(table) * OFFSET_SIZE
+    inputShm = shared_memory.SharedMemory(create=True, size=max(1, tableSize + table[-1]))
+    inputShm.buf[:tableSize] = table.tobytes()
+    inputShm.buf[tableSize:tableSize + table[-1]] = b''.join(encoded)
+    return inputShm
+
+
+def parallel_levels(leafData, realSize, padDigest, hashName, batched, workers):
+    '''
+    函数功能：把叶子切分成若干棵 2 的整数幂大小的子树，在进程池中分别构建
+    叶子数据和构建结果都通过共享内存传递，提交给子进程的只有几个整数和共享内存的名字
+    返回：从叶子层到子树树根层的所有层；叶子太少的时候返回 None
+    '''
+    size = len(leafData)
+    chunk = max(MIN_CHUNK, 2**math.ceil(math.log2(size / (workers * 4))))
+    if size <= chunk:
+        return None
+
+    # 每一层的节点数量，以及在共享内存中的起始位置
+    sizes = [math.ceil(size / 2**depth) for depth in range(int(math.log2(chunk)) + 1)]
+    offsets = [0]
+    for levelSize in sizes[:-1]:
+        offsets.append(offsets[-1] + levelSize * DIGEST_SIZE)
+
+    inputShm = share_leaves(leafData[:realSize])
+    shm = shared_memory.SharedMemory(create=True, size=sum(sizes) * DIGEST_SIZE)
+    try:
+        with ProcessPoolExecutor(workers) as pool:
+            futures = []
+            for start in range(0, size, chunk):
+                stop = min(start + chunk, size)
+                futures.append(pool.submit(
+                    build_subtree, inputShm.name, realSize, shm.name, offsets, start, stop, padDigest,
+                    hashName, batched))
+            for future in futures:
+                future.result()
+        return [bytearray(shm.buf[offset:offset + levelSize * DIGEST_SIZE])
+                for offset, levelSize in zip(offsets, sizes)]
+    finally:
+        for thisShm in (inputShm, shm):
+            thisShm.close()
+            thisShm.unlink()
+
+
+class FlatMerkleTree:
+    '''
+    数组存储的 Merkle 树
+    levels[0] 为叶子层，levels[-1] 只有一个节点，即树根
+    hashName 为 hash 算法（sha256 / blake2b / blake3）
+    batched 为 True 时，批量构建会一次计算一整层，而不是逐个节点计算
+    '''
+
+    def __init__(self, hashName='sha256', batched=True):
+        self.hashName = hashName
+        self.hashFunc = get_hash_backend(hashName)
+        self.batched = batched
+        self.way = 'imbalance'      # 构造方式（filling / imbalance）
+        self.leafData = []          # 叶子节点保存的数据
+        self.levels = [bytearray()]  # 每一层的 hash 值
+
+    def calculate_hash(self, data):
+        '''
+        函数功能：计算hash值，输入输出均为字节串
+        '''
+        return self.hashFunc(data)
+
+    def __len__(self):
+        return len(self.leafData)
+
+    def depth(self):
+        '''
+        函数功能：树的高度（只有一个叶子时为 0）
+        '''
+        return len(self.levels) - 1
+
+    def node_hash(self, level, index):
+        '''
+        函数功能：取出第 level 层第 index 个节点的 hash 值
+        '''
+        return bytes(self.levels[level][index*DIGEST_SIZE:(index+1)*DIGEST_SIZE])
+
+    def root_hash(self):
+        '''
+        函数功能：树根的 hash 值，空树返回 None
+        '''
+        if len(self.leafData) == 0:
+            return None
+        return self.node_hash(len(self.levels)-1, 0)
+
+    def level_size(self, level):
+        return len(self.levels[level]) // DIGEST_SIZE
+
+    def merge_hash(self, level, index):
+        '''
+        函数功能：根据第 level 层的孩子，计算第 level+1 层第 index 个节点的 hash 值
+        只有左孩子的时候（imbalance），父节点的 hash 为左孩子 hash 的 hash
+        '''
+        children = self.levels[level]
+        start = 2 * index * DIGEST_SIZE
+        end = min(start + 2*DIGEST_SIZE, len(children))
+        return self.calculate_hash(children[start:end])
+
+    def build_merkle_tree(self, nodeData, way='filling', sorted=False, workers=None):
+        '''
+        参数：workers 大于 1 时，使用多进程构建（结果与单进程构建完全一致）
+        '''
+        if len(nodeData) == 0:
+            logger.warning('构建了个寂寞')
+            return
+        start = time.perf_counter()
+
+        if sorted == True:
+            nodeData = [int(i) for i in nodeData]
+            nodeData.sort()
+            nodeData = [str(i) for i in nodeData]
+
+        self.way = way
+        self.leafData = list(nodeData)
+        realSize = len(self.leafData)
+
+        padDigest = None
+        if way == 'filling':
+            # 为整棵树补充需要的节点（将最后一个节点复制若干次）
+            treeDepth = math.ceil(math.log2(len(self.leafData)))
+            padding = 2**treeDepth - len(self.leafData)
+            if padding > 0:
+                padDigest = self.calculate_hash(
+                    self.calculate_hash(self.leafData[-1].encode('utf-8')))
+                self.leafData.extend([self.leafData[-1]] * padding)
+
+        levels = None
+        if workers != None and workers > 1:
+            levels = parallel_levels(self.leafData, realSize, padDigest,
+                                     self.hashName, self.batched, workers)
+        if levels == None:
+            # 计算所有叶子的 hash 值
+            if self.batched:
+                leaves = bytearray(hash_leaves(self.leafData[:realSize], self.hashName))
+            else:
+                leaves = bytearray()
+                for data in self.leafData[:realSize]:
+                    leaves += self.calculate_hash(data.encode('utf-8'))
+            if padDigest != None:
+                leaves += padDigest * (len(self.leafData) - realSize)
+            levels = [leaves]
+
+        self.levels = levels
+        self.build_levels()
+        if logger.isEnabledFor(logging.INFO):
+            # 真实叶子各一次、补充叶子的摘要两次，加上每个中间节点一次
+            hashCount = realSize + (2 if padDigest != None else 0) + \
+                sum(self.level_size(level) for level in range(1, len(self.levels)))
+            logger.info('构建完成：%d 个叶子，耗时 %.6f 秒，计算 %d 次 hash',
+                        realSize, time.perf_counter() - start, hashCount)
+
+    def build_levels(self):
+        '''
+        函数功能：由当前最高的一层逐层向上合并，得到剩余的中间层
+        '''
+        level = len(self.levels) - 1
+        while self.level_size(level) > 1:
+            parents = hash_level(self.levels[level], self.hashName, self.batched)
+            self.levels.append(parents)
+            level += 1
+
+    def own_levels(self):
+        '''
+        函数功能：修改之前，把只读的层（MerkleCodec 零拷贝解码得到的 memoryview）复制为 bytearray
+        '''
+        for level, data in enumerate(self.levels):
+            if isinstance(data, memoryview):
+                self.levels[level] = bytearray(data)
+
+    def update_path(self, index):
+        '''
+        函数功能：自下而上更新第 index 个叶子到树根路径上的节点
+        如果上一层还没有对应的节点（新增的叶子），就在这一层的末尾添加
+        '''
+        level = 0
+        while self.level_size(level) > 1:
+            index = index // 2
+            if level + 1 == len(self.levels):
+                self.levels.append(bytearray())
+            parents = self.levels[level+1]
+            digest = self.merge_hash(level, index)
+            if index * DIGEST_SIZE == len(parents):
+                parents += digest
+            else:
+                parents[index*DIGEST_SIZE:(index+1)*DIGEST_SIZE] = digest
+            level += 1
+        # 删除树根以上多余的层
+        del self.levels[level+1:]
+
+    def truncate_levels(self):
+        '''
+        函数功能：叶子减少之后，裁掉每一层多出来的节点
+        '''
+        size = self.level_size(0)
+        for level in range(1, len(self.levels)):
+            if size <= 1:
+                del self.levels[level:]
+                break
+            size = (size + 1) // 2
+            del self.levels[level][size*DIGEST_SIZE:]
+
+    def add(self, Data):
+        '''
+        函数功能：在树的最右边添加一个叶子，只需要更新一条路径
+        返回值：新叶子的下标
+        '''
+        # 先计算 hash 值（数据有误时在这里报错），再修改树
+        digest = self.calculate_hash(Data.encode('utf-8'))
+        self.own_levels()
+        self.leafData.append(Data)
+        self.levels[0] += digest
+        index = len(self.leafData) - 1
+        self.update_path(index)
+        return index
+
+    def update(self, index, Data):
+        '''
+        函数功能：修改第 index 个叶子的数据，只需要更新一条路径
+        '''
+        if index < 0 or index >= len(self.leafData):
+            logger.warning('这棵树上没有这个叶子')
+            return
+
+        digest = self.calculate_hash(Data.encode('utf-8'))
+        self.own_levels()
+        self.leafData[index] = Data
+        self.levels[0][index*DIGEST_SIZE:(index+1)*DIGEST_SIZE] = digest
+        self.update_path(index)
+
+    def remove(self, index):
+        '''
+        函数功能：删除第 index 个叶子
+        说明：用最后一个叶子填补被删除的位置，这样只需要更新两条路径
+        '''
+        if index < 0 or index >= len(self.leafData):
+            logger.warning('这棵树上没有这个叶子')
+            return
+
+        self.own_levels()
+        last = len(self.leafData) - 1
+        leaves = self.levels[0]
+        if index != last:
+            self.leafData[index] = self.leafData[last]
+            leaves[index*DIGEST_SIZE:(index+1)*DIGEST_SIZE] = leaves[last*DIGEST_SIZE:]
+        self.leafData.pop()
+        del leaves[last*DIGEST_SIZE:]
+        self.truncate_levels()
+
+        if index < last:
+            self.update_path(index)
+        if last > 0:
+            # 新的最后一个叶子，它的父亲可能只剩一个孩子了
+            self.update_path(last - 1)
+
+    def view_node(self, level, index):
+        '''
+        函数功能：为第 level 层第 index 个节点临时生成一个 TreeNode（只用于展示）
+        '''
+        first = index * 2**level
+        last = min(first + 2**level, len(self.leafData)) - 1
+        if first == last:
+            value = self.leafData[first]
+        else:
+            value = self.leafData[first] + ' ~ ' + self.leafData[last]
+        return TreeNode(
+            value=value,
+            hash=self.node_hash(level, index).hex(),
+            childNum=last - first + 1,
+            depth=level,
+            id='%d-%d' % (level, index),
+        )
+
+    def as_tree_node(self, level=None, index=0):
+        '''
+        函数功能：把（子）树物化为 TreeNode 结构，只在 show() 的时候使用
+        '''
+        if len(self.leafData) == 0:
+            return None
+        if level == None:
+            level = len(self.levels) - 1
+        node = self.view_node(level, index)
+        if level > 0:
+            node.leftNode = self.as_tree_node(level-1, 2*index)
+            node.leftNode.father = node
+            if 2*index + 1 < self.level_size(level-1):
+                node.rightNode = self.as_tree_node(level-1, 2*index+1)
+                node.rightNode.father = node
+        return node
+
+    def search(self, index, showNode=False):
+        '''
+        函数功能：查询第 index 个叶子，并生成证明路径（TreeNode 形式，便于展示）
+        '''
+        if index < 0 or index >= len(self.leafData):
+            logger.warning('这棵树上没有这个叶子')
+            return None, None
+
+        top = len(self.levels) - 1
+        proofPath = self.view_node(top, 0)
+        proofPath.value = 'Root'
+        proofNode = proofPath
+        for level in range(top, 0, -1):
+            position = index >> (level - 1)
+            sibling = position ^ 1
+            if sibling < self.level_size(level-1):
+                refNode = self.view_node(level-1, sibling)
+                refNode.value = 'Ref Hash'
+                refNode.father = proofNode
+                if sibling & 1:
+                    proofNode.rightNode = refNode
+                else:
+                    proofNode.leftNode = refNode
+            nextNode = self.view_node(level-1, position)
+            nextNode.value = '✱'
+            nextNode.father = proofNode
+            if position & 1:
+                proofNode.rightNode = nextNode
+            else:
+                proofNode.leftNode = nextNode
+            proofNode = nextNode
+
+        thisNode = self.view_node(0, index)
+        proofNode.value = 'Target'
+        return thisNode, proofPath
+
+    def get_proof(self, index):
+        '''
+        函数功能：生成第 index 个叶子的存在性证明（MerkleProof），时间复杂度 O(log n)
+        '''
+        if index < 0 or index >= len(self.leafData):
+            logger.warning('这棵树上没有这个叶子')
+            return None
+
+        proofPath = []
+        position = index
+        for level in range(len(self.levels) - 1):
+            sibling = position ^ 1
+            if sibling < self.level_size(level):
+                proofPath.append((self.node_hash(level, sibling), sibling < position))
+            else:
+                proofPath.append((None, False))
+            position = position // 2
+        return MerkleProof(self.node_hash(0, index), proofPath, len(self.leafData), self.hashName, raw=True)
+
+    def get_multiproof(self, indexes):
+        '''
+        函数功能：为多个叶子生成一个共同的证明（MerkleMultiProof），共同的兄弟节点只出现一次
+        '''
+        nodes = set()
+        for index in indexes:
+            if index < 0 or index >= len(self.leafData):
+                logger.warning('这棵树上没有这个叶子：%s', index)
+                return None
+            for level in range(len(self.levels)):
+                nodes.add((level, index >> level))
+
+        def hashOf(level, position):
+            if position < self.level_size(level):
+                return self.node_hash(level, position)
+            return None
+
+        return build_multiproof(nodes, hashOf, len(self.levels) - 1, len(self.leafData),
+                                self.hashName, raw=True)
+
+    def merkle_path(self, proofPath):
+        '''
+        描述：从叶子到树根的路径称为 Merkle Path ，它可以用来证明事务(string)的存在
+        参数：proofPath 由 search() 生成的证明路径
+        '''
+        if proofPath == None:
+            logger.warning('请检查验证路径的合理性')
+            return
+
+        # 找到目标叶子
+        thisNode = proofPath
+        while thisNode.leftNode or thisNode.rightNode:
+            if thisNode.leftNode and thisNode.leftNode.value != 'Ref Hash':
+                thisNode = thisNode.leftNode
+            else:
+                thisNode = thisNode.rightNode
+
+        thisNode = thisNode.father
+        while thisNode != None:
+            mergeHash = b''
+            if thisNode.leftNode:
+                mergeHash = bytes.fromhex(thisNode.leftNode.hash)
+            if thisNode.rightNode:
+                mergeHash = mergeHash + bytes.fromhex(thisNode.rightNode.hash)
+
+            mergeHash = self.calculate_hash(mergeHash).hex()
+            thisNode.hashIsRight = thisNode.hash == mergeHash
+            thisNode.hash = mergeHash
+            thisNode = thisNode.father
+
+        dot = show_tree(proofPath, proof=True)
+        if proofPath.hashIsRight:
+            dot.attr(label=r'\nMerkle tree is complete')
+        else:
+            dot.attr(label=r'\nMerkle tree has been modified')
+        return dot
+
+    def show(self, node=0, proof=False, showDepth=True, string=None):
+        # 默认值为展示整棵树
+        if node == 0:
+            node = self.as_tree_node()
+        return show_tree(node, proof=proof, showDepth=showDepth, string=string)
+
+
+def iter_records(source):
+    '''
+    函数功能：逐条读取数据
+    source 可以是文件路径、打开的文件（每行一条数据），或者任意可迭代对象
+    '''
+    if isinstance(source, str):
+        with open(source, encoding='utf-8') as f:
+            yield from iter_records(f)
+        return
+    if hasattr(source, 'readline'):
+        for line in source:
+            newline = b'\n' if isinstance(line, bytes) else '\n'
+            yield line[:-1] if line.endswith(newline) else line
+        return
+    yield from source
+
+
+class MerkleStream:
+    '''
+    流式构建 Merkle 树
+    类似二进制计数器：每一层最多保留一个等待合并的 hash 值，内存占用为 O(log n)
+    得到的树根与 FlatMerkleTree 使用同样的数据、同样的 way 构建的树根一致
+    spillDir 不为空时，每一层的节点依次写入 spillDir/level_<层号>.bin
+    '''
+
+    def __init__(self, hashName='sha256', spillDir=None):
+        self.hashFunc = get_hash_backend(hashName)
+        self.pending = []     # pending[level] 为该层等待合并的节点（完整的子树）
+        self.size = 0         # 已经读入的叶子数量
+        self.lastLeaf = None  # 最后一个叶子的 hash 值（filling 时用于补充节点）
+        self.spillDir = spillDir
+        self.spillFiles = {}
+
+    def spill(self, level, digest):
+        '''
+        函数功能：把第 level 层的一个节点写入文件
+        '''
+        if self.spillDir == None:
+            return
+        if level not in self.spillFiles:
+            self.spillFiles[level] = open(
+                os.path.join(self.spillDir, 'level_%d.bin' % level), 'ab')
+        self.spillFiles[level].write(digest)
+
+    def add(self, Data):
+        '''
+        函数功能：读入一个叶子，向上合并所有已经完整的子树
+        '''
+        if isinstance(Data, str):
+            Data = Data.encode('utf-8')
+        digest = self.hashFunc(Data)
+        self.lastLeaf = digest
+        self.size += 1
+        self.spill(0, digest)
+
+        level = 0
+        while level < len(self.pending) and self.pending[level] != None:
+            digest = self.hashFunc(self.pending[level] + digest)
+            self.pending[level] = None
+            level += 1
+            self.spill(level, digest)
+        if level == len(self.pending):
+            self.pending.append(None)
+        self.pending[level] = digest
+
+    def extend(self, source):
+        for Data in iter_records(source):
+            self.add(Data)
+
+    def fold(self, way='imbalance', spill=False):
+        '''
+        函数功能：自下而上合并右边缘上不完整的节点，得到树根
+        spill 为 True 时，把这些不完整的节点（以及 filling 补充的节点）写入文件
+        '''
+        if self.size == 0:
+            return None
+        height = math.ceil(math.log2(self.size))
+
+        # filling 时，补充的节点组成的完整子树在每一层的 hash 值
+        padDigest = None
+        if way == 'filling':
+            padDigest = self.hashFunc(self.lastLeaf)
+
+        carry = None  # 当前层右边缘上不完整的节点
+        for level in range(height):
+            if spill and carry != None:
+                self.spill(level, carry)
+            if spill and padDigest != None:
+                padCount = 2**(height - level) - math.ceil(self.size / 2**level)
+                for _ in range(padCount):
+                    self.spill(level, padDigest)
+
+            node = self.pending[level] if level < len(self.pending) else None
+            right = carry
+            if node == None:
+                node, right = carry, None
+            if node == None:
+                parent = None
+            elif right != None:
+                parent = self.hashFunc(node + right)
+            elif padDigest != None:
+                parent = self.hashFunc(node + padDigest)
+            else:
+                parent = self.hashFunc(node)
+            carry = parent
+
+            if padDigest != None:
+                padDigest = self.hashFunc(padDigest + padDigest)
+
+        if carry == None:
+            return self.pending[height]
+        if spill:
+            self.spill(height, carry)
+        return carry
+
+    def root_hash(self, way='imbalance'):
+        return self.fold(way)
+
+    def finish(self, way='imbalance'):
+        '''
+        函数功能：结束读入，返回树根；如果需要，把剩余的节点写入文件
+        '''
+        rootHash = self.fold(way, spill=self.spillDir != None)
+        for f in self.spillFiles.values():
+            f.close()
+        self.spillFiles = {}
+        return rootHash
+
+
+def stream_merkle_root(source, way='imbalance', hashName='sha256', spillDir=None):
+    '''
+    函数功能：不把数据全部读入内存，直接计算树根
+    '''
+    stream = MerkleStream(hashName, spillDir)
+    stream.extend(source)
+    return stream.finish(way)
@@ -0,0 +1,358 @@
+from FlatMerkleTree import FlatMerkleTree
+from MerkleHash import DIGEST_SIZE
+from MerkleProof import MerkleMultiProof, MerkleProof, leaf_data
+from MerkleTree import MerkleTree, TreeNode
+import io
+import struct
+
+'''
+Merkle 树与证明的二进制格式
+
+所有数据以同一个文件头开始：
+    magic(4) = b'MRKL'  version(1)  kind(1)  hashId(1)
+整数均为小端序，hash 值一律以 32 字节的摘要保存（十六进制模式的树 / 证明在解码时再转换回来）。
+
+kind = KIND_FLAT        FlatMerkleTree：布局、叶子数量、每一层的摘要、叶子数据
+kind = KIND_TREE        MerkleTree：树的参数、每个叶子的位置和元数据，中间节点在解码时重新计算；
+                        persistent 的树只保存当前版本，解码之后 versions 中只有当前这一代
+kind = KIND_PROOF       MerkleProof
+kind = KIND_MULTIPROOF  MerkleMultiProof
+
+编码通过 write_*(obj, f) 分段写入文件对象，不需要把整个结果拼在内存中；
+解码通过 memoryview 读取，FlatMerkleTree 的每一层直接引用输入数据（零拷贝），
+第一次修改时才复制（FlatMerkleTree.own_levels）。
+'''
+
+MAGIC = b'MRKL'
+VERSION = 1
+
+KIND_FLAT = 1
+KIND_TREE = 2
+KIND_PROOF = 3
+KIND_MULTIPROOF = 4
+
+HASH_IDS = {'sha256': 1, 'blake2b': 2, 'blake3': 3}
+HASH_NAMES = {hashId: hashName for hashName, hashId in HASH_IDS.items()}
+LAYOUTS = {'filling': 0, 'imbalance': 1}
+LAYOUT_NAMES = {layoutId: way for way, layoutId in LAYOUTS.items()}
+INDEXES = {'prime': 0, 'hash': 1}
+INDEX_NAMES = {indexId: index for index, indexId in INDEXES.items()}
+
+HEADER = struct.Struct('<4sBBB')
+FLAT_HEADER = struct.Struct('<BQB')         # 布局、叶子数量、层数
+TREE_HEADER = struct.Struct('<BBBBBQQBQ')   # index、raw、sorted、布局、persistent、history、nextKey、树高、叶子数量
+LEAF_HEADER = struct.Struct('<QQ')          # 叶子位置、generation
+PROOF_HEADER = struct.Struct('<BQH')        # 标志位、叶子数量、路径长度
+MULTIPROOF_HEADER = struct.Struct('<BQHII')  # raw、叶子数量、树高、证明的叶子数、兄弟节点数
+SIBLING_HEADER = struct.Struct('<HQB')      # 层号、位置、是否存在
+LENGTH = struct.Struct('<I')
+SIZE = struct.Struct('<Q')
+
+PROOF_RAW = 1        # hash 值为字节串
+PROOF_LEAF = 2       # 附带叶子数据和叶子标号（不存在性证明中使用）
+SIBLING_LEFT = 1     # 兄弟节点在左边
+SIBLING_PRESENT = 2  # 兄弟节点存在
+
+
+def to_digest(thisHash):
+    '''
+    函数功能：把 hash 值（摘要或十六进制字符串）转换为 32 字节的摘要
+    '''
+    if isinstance(thisHash, str):
+        return bytes.fromhex(thisHash)
+    return bytes(thisHash)
+
+
+def from_digest(digest, raw):
+    return bytes(digest) if raw else bytes(digest).hex()
+
+
+def write_string(f, value):
+    value = value.encode('utf-8')
+    f.write(LENGTH.pack(len(value)))
+    f.write(value)
+
+
+class Reader:
+    '''
+    在 memoryview 上顺序读取，不复制数据
+    '''
+
+    def __init__(self, data):
+        self.view = memoryview(data)
+        self.offset = 0
+
+    def unpack(self, layout):
+        values = layout.unpack_from(self.view, self.offset)
+        self.offset += layout.size
+        return values
+
+    def take(self, size):
+        if self.offset + size > len(self.view):
+            raise ValueError('数据不完整')
+        data = self.view[self.offset:self.offset+size]
+        self.offset += size
+        return data
+
+    def digest(self):
+        return bytes(self.take(DIGEST_SIZE))
+
+    def string(self):
+        (size,) = self.unpack(LENGTH)
+        return str(self.take(size), 'utf-8')
+
+
+def write_header(f, kind, hashName):
+    f.write(HEADER.pack(MAGIC, VERSION, kind, HASH_IDS[hashName]))
+
+
+def read_header(reader, kind=None):
+    magic, version, thisKind, hashId = reader.unpack(HEADER)
+    if magic != MAGIC:
+        raise ValueError('不是 Merkle 树的二进制数据')
+    if version != VERSION:
+        raise ValueError('不支持的版本：%d' % version)
+    if kind != None and thisKind != kind:
+        raise ValueError('数据类型不匹配：%d' % thisKind)
+    return thisKind, HASH_NAMES[hashId]
+
+
+def write_flat_tree(tree, f):
+    '''
+    函数功能：把 FlatMerkleTree 分段写入文件对象 f
+    '''
+    write_header(f, KIND_FLAT, tree.hashName)
+    f.write(FLAT_HEADER.pack(LAYOUTS[tree.way], len(tree.leafData), len(tree.levels)))
+    for level in tree.levels:
+        f.write(SIZE.pack(len(level)))
+        f.write(level[0:] if not isinstance(level, (bytes, bytearray, memoryview)) else level)
+    for data in tree.leafData:
+        write_string(f, data)
+
+
+def read_flat_tree(reader):
+    _, hashName = read_header(reader, KIND_FLAT)
+    layout, leafCount, levelCount = reader.unpack(FLAT_HEADER)
+    tree = FlatMerkleTree(hashName=hashName)
+    tree.way = LAYOUT_NAMES[layout]
+    tree.levels = []
+    for _ in range(levelCount):
+        (size,) = reader.unpack(SIZE)
+        tree.levels.append(reader.take(size))
+    tree.leafData = [reader.string() for _ in range(leafCount)]
+    return tree
+
+
+def write_tree(tree, f):
+    '''
+    函数功能：把 MerkleTree 分段写入文件对象 f
+    只保存叶子（位置、generation、hash 值、数据、标号、id），中间节点在解码时重新计算
+    persistent 的树不保存历史版本（versions），只保存当前版本
+    '''
+    write_header(f, KIND_TREE, tree.hashName)
+    leaves = []
+    depth = 0
+    for leaf in tree.leafIndex.values():
+        # 由父亲节点向上走，得到叶子的位置
+        position, level, thisNode = 0, 0, leaf
+        while thisNode.father != None:
+            if thisNode.father.rightNode == thisNode:
+                position |= 1 << level
+            thisNode = thisNode.father
+            level += 1
+        depth = level
+        leaves.append((position, leaf))
+    leaves.sort(key=lambda item: item[0])
+
+    f.write(TREE_HEADER.pack(INDEXES[tree.index], tree.raw, tree.sorted, LAYOUTS[tree.way], tree.persistent,
+                             tree.history, tree.nextKey, depth, len(leaves)))
+    f.write(to_digest(tree.root.hash) if leaves else bytes(DIGEST_SIZE))
+    for position, leaf in leaves:
+        f.write(LEAF_HEADER.pack(position, leaf.generation))
+        f.write(to_digest(leaf.hash))
+        write_string(f, leaf.value)
+        write_string(f, str(leaf.primeNum))
+        write_string(f, str(leaf.id))
+
+
+def read_tree(reader):
+    _, hashName = read_header(reader, KIND_TREE)
+    index, raw, isSorted, layout, persistent, history, nextKey, depth, leafCount = reader.unpack(TREE_HEADER)
+    rootHash = from_digest(reader.digest(), raw)
+
+    tree = MerkleTree(index=INDEX_NAMES[index], hashName=hashName, raw=bool(raw), persistent=bool(persistent))
+    tree.history = history
+    tree.nextKey = nextKey
+    tree.sorted = bool(isSorted)
+    tree.way = LAYOUT_NAMES[layout]
+    if leafCount == 0:
+        tree.root = tree.empty_root()
+        tree.build_value_index()
+        tree.save_version()
+        return tree
+
+    layer = {}
+    for _ in range(leafCount):
+        position, generation = reader.unpack(LEAF_HEADER)
+        leaf = TreeNode(
+            value=None,
+            hash=from_digest(reader.digest(), raw),
+            depth=0,
+            childNum=0,
+            generation=generation,
+        )
+        leaf.value = reader.string()
+        leaf.primeNum = reader.string()
+        leaf.id = int(reader.string())
+        # 树根只能保证叶子的 hash 值没有被改动，叶子的数据和标号要与 hash 值逐个核对
+        if leaf.hash != tree.calculate_hash(leaf_data(leaf.value, leaf.primeNum)):
+            raise ValueError('叶子 %s 的 hash 值与数据不一致，数据可能已损坏' % leaf.primeNum)
+        tree.register_leaf(leaf)
+        tree.nextId = max(tree.nextId, leaf.id + 1)
+        layer[position] = leaf
+
+    # 自下而上逐层重建中间节点
+    for level in range(depth):
+        parents = {}
+        for position, child in layer.items():
+            father = parents.get(position // 2)
+            if father == None:
+                father = tree.new_node(
+                    value=None,
+                    depth=level+1,
+                    childNum=0,
+                    generation=child.generation,
+                )
+                parents[position // 2] = father
+            if position & 1:
+                father.rightNode = child
+            else:
+                father.leftNode = child
+            child.father = father
+            father.childNum += child.childNum if child.depth > 0 else 1
+            father.generation = max(father.generation, child.generation)
+        for father in parents.values():
+            tree.merge_node(father)
+        layer = parents
+
+    tree.root = layer[0]
+    if tree.root.hash != rootHash:
+        raise ValueError('树根的 hash 值不一致，数据可能已损坏')
+    # 有序树的值索引由叶子重新建立
+    tree.build_value_index()
+    tree.save_version()
+    return tree
+
+
+def write_proof(proof, f):
+    '''
+    函数功能：把 MerkleProof 写入文件对象 f
+    '''
+    write_header(f, KIND_PROOF, proof.hashName)
+    flags = PROOF_RAW if proof.raw else 0
+    if proof.leafValue != None:
+        flags |= PROOF_LEAF
+    f.write(PROOF_HEADER.pack(flags, proof.treeSize, len(proof.path)))
+    f.write(to_digest(proof.leafHash))
+    for sibling, isLeft in proof.path:
+        f.write(bytes([(SIBLING_LEFT if isLeft else 0) | (SIBLING_PRESENT if sibling != None else 0)]))
+        if sibling != None:
+            f.write(to_digest(sibling))
+    if flags & PROOF_LEAF:
+        write_string(f, proof.leafValue)
+        write_string(f, proof.leafKey)
+
+
+def read_proof(reader):
+    _, hashName = read_header(reader, KIND_PROOF)
+    flags, treeSize, pathLength = reader.unpack(PROOF_HEADER)
+    raw = bool(flags & PROOF_RAW)
+    leafHash = from_digest(reader.digest(), raw)
+    path = []
+    for _ in range(pathLength):
+        entry = reader.take(1)[0]
+        sibling = None
+        if entry & SIBLING_PRESENT:
+            sibling = from_digest(reader.digest(), raw)
+        path.append((sibling, bool(entry & SIBLING_LEFT)))
+    proof = MerkleProof(leafHash, path, treeSize, hashName, raw)
+    if flags & PROOF_LEAF:
+        proof.leafValue = reader.string()
+        proof.leafKey = reader.string()
+    return proof
+
+
+def write_multiproof(proof, f):
+    '''
+    函数功能：把 MerkleMultiProof 写入文件对象 f
+    '''
+    write_header(f, KIND_MULTIPROOF, proof.hashName)
+    f.write(MULTIPROOF_HEADER.pack(proof.raw, proof.treeSize, proof.depth,
+                                   len(proof.leaves), len(proof.siblings)))
+    for position, leafHash in sorted(proof.leaves.items()):
+        f.write(SIZE.pack(position))
+        f.write(to_digest(leafHash))
+    for (level, position), sibling in proof.siblings:
+        f.write(SIBLING_HEADER.pack(level, position, sibling != None))
+        if sibling != None:
+            f.write(to_digest(sibling))
+
+
+def read_multiproof(reader):
+    _, hashName = read_header(reader, KIND_MULTIPROOF)
+    raw, treeSize, depth, leafCount, siblingCount = reader.unpack(MULTIPROOF_HEADER)
+    raw = bool(raw)
+    leaves = {}
+    for _ in range(leafCount):
+        (position,) = reader.unpack(SIZE)
+        leaves[position] = from_digest(reader.digest(), raw)
+    siblings = []
+    for _ in range(siblingCount):
+        level, position, present = reader.unpack(SIBLING_HEADER)
+        siblings.append(((level, position), from_digest(reader.digest(), raw) if present else None))
+    return MerkleMultiProof(leaves, siblings, depth, treeSize, hashName, raw)
+
+
+WRITERS = [
+    (FlatMerkleTree, write_flat_tree),
+    (MerkleTree, write_tree),
+    (MerkleProof, write_proof),
+    (MerkleMultiProof, write_multiproof),
+]
+READERS = {
+    KIND_FLAT: read_flat_tree,
+    KIND_TREE: read_tree,
+    KIND_PROOF: read_proof,
+    KIND_MULTIPROOF: read_multiproof,
+}
+
+
+def dump(obj, f):
+    '''
+    函数功能：把树或证明分段写入文件对象 f
+    '''
+    for kind, writer in WRITERS:
+        if isinstance(obj, kind):
+            return writer(obj, f)
+    raise TypeError('不支持序列化的类型：%s' % type(obj).__name__)
+
+
+def dumps(obj):
+    f = io.BytesIO()
+    dump(obj, f)
+    return f.getvalue()
+
+
+def loads(data):
+    '''
+    函数功能：从字节串（bytes / bytearray / mmap 等）解码树或证明
+    FlatMerkleTree 的每一层直接引用 data，调用者不能在树被修改之前改动 data
+    '''
+    reader = Reader(data)
+    kind, _ = read_header(reader)
+    reader.offset = 0
+    return READERS[kind](reader)
+
+
+def load(f):
+    return loads(f.read())
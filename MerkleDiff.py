@@ -0,0 +1,147 @@
+from FlatMerkleTree import FlatMerkleTree
+from MerkleTree import MerkleTree
+
+'''
+比较两棵 Merkle 树，找出不同的叶子
+
+同时从两棵树的树根向下走，hash 值相同的子树整棵跳过，只进入不同的子树，
+有 k 处不同时时间复杂度为 O(k log n)。
+叶子按位置比较（第 level 层第 index 个节点覆盖第 index*2**level ~ (index+1)*2**level-1 个叶子），
+两棵树高度不同时，较矮的树的树根看作较高的树中最左边的那棵子树。
+
+说明：MerkleTree 叶子的 hash 值包含叶子标号（按添加顺序分配），所以只有同一棵树的不同版本
+（persistent=True 时的 versions），或者以相同顺序添加叶子的两棵树之间的比较才有意义；
+FlatMerkleTree 的叶子只由数据决定。
+'''
+
+VIRTUAL = 'virtual'  # 较矮的树中，高于树根的（不存在的）祖先节点
+
+
+def merge_ranges(ranges):
+    '''
+    函数功能：合并相邻或重叠的叶子区间 [(start, stop)]
+    '''
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def flat_node(tree, level, index):
+    '''
+    函数功能：FlatMerkleTree 第 level 层第 index 个节点（不存在时返回 None）
+    '''
+    if len(tree) == 0:
+        return None
+    if level > tree.depth():
+        return VIRTUAL if index == 0 else None
+    if index >= tree.level_size(level):
+        return None
+    return tree.node_hash(level, index)
+
+
+def diff_flat(treeA, treeB):
+    '''
+    函数功能：比较两棵 FlatMerkleTree，返回不同的叶子区间 [(start, stop)]（左闭右开）
+    '''
+    size = max(len(treeA), len(treeB))
+    top = max(treeA.depth(), treeB.depth())
+    ranges = []
+    stack = [(top, 0)]
+    while len(stack) != 0:
+        level, index = stack.pop()
+        hashA = flat_node(treeA, level, index)
+        hashB = flat_node(treeB, level, index)
+        if hashA == None and hashB == None:
+            continue
+        if hashA == None or hashB == None:
+            # 只有一边有这棵子树，整棵子树的叶子都不同
+            ranges.append((index << level, min((index + 1) << level, size)))
+        elif hashA != VIRTUAL and hashA == hashB:
+            continue
+        elif level == 0:
+            ranges.append((index, index + 1))
+        else:
+            stack.append((level - 1, 2 * index + 1))
+            stack.append((level - 1, 2 * index))
+    return merge_ranges(ranges)
+
+
+def node_children(node, level, root):
+    '''
+    函数功能：TreeNode 的左右孩子；高于树根的层，左孩子是树根（或者更低的虚拟祖先）
+    '''
+    if node == VIRTUAL:
+        return (root if level - 1 == root.depth else VIRTUAL), None
+    return node.leftNode, node.rightNode
+
+
+def leaf_extent(node, level, index):
+    '''
+    函数功能：node 子树中实际存在的最左、最右叶子的位置（子树最右边可能不满）
+    返回：叶子区间 (start, stop)
+    '''
+    extent = []
+    for first, second in (('leftNode', 'rightNode'), ('rightNode', 'leftNode')):
+        thisNode, thisLevel, thisIndex = node, level, index
+        while thisLevel > 0:
+            child = getattr(thisNode, first)
+            side = first
+            if child == None:
+                child = getattr(thisNode, second)
+                side = second
+            thisIndex = 2 * thisIndex + (1 if side == 'rightNode' else 0)
+            thisNode, thisLevel = child, thisLevel - 1
+        extent.append(thisIndex)
+    return extent[0], extent[1] + 1
+
+
+def diff_nodes(rootA, rootB):
+    '''
+    函数功能：比较两个 TreeNode 树根（例如同一棵树的两个版本），返回不同的叶子区间 [(start, stop)]
+    只在一边存在的子树按它最左、最右的叶子给出区间
+    '''
+    # 空树（树桩）没有任何叶子
+    rootA = rootA if rootA != None and rootA.childNum > 0 else None
+    rootB = rootB if rootB != None and rootB.childNum > 0 else None
+    if rootA == None and rootB == None:
+        return []
+    top = max(root.depth for root in (rootA, rootB) if root != None)
+
+    def lift(root):
+        if root == None or root.depth == top:
+            return root
+        return VIRTUAL
+
+    ranges = []
+    stack = [(lift(rootA), lift(rootB), top, 0)]
+    while len(stack) != 0:
+        nodeA, nodeB, level, index = stack.pop()
+        if nodeA == None and nodeB == None:
+            continue
+        if nodeA == None or nodeB == None:
+            ranges.append(leaf_extent(nodeA or nodeB, level, index))
+        elif nodeA != VIRTUAL and nodeB != VIRTUAL and nodeA.hash == nodeB.hash:
+            continue
+        elif level == 0:
+            ranges.append((index, index + 1))
+        else:
+            leftA, rightA = node_children(nodeA, level, rootA)
+            leftB, rightB = node_children(nodeB, level, rootB)
+            stack.append((rightA, rightB, level - 1, 2 * index + 1))
+            stack.append((leftA, leftB, level - 1, 2 * index))
+    return merge_ranges(ranges)
+
+
+def diff(a, b):
+    '''
+    函数功能：比较两棵树（FlatMerkleTree / MerkleTree / TreeNode 树根），返回不同的叶子区间
+    '''
+    if isinstance(a, FlatMerkleTree):
+        return diff_flat(a, b)
+    if isinstance(a, MerkleTree):
+        a, b = a.root, b.root
+    return diff_nodes(a, b)
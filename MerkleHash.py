@@ -0,0 +1,107 @@
+from functools import partial
+import hashlib
+import struct
+
+try:
+    import blake3
+except ImportError:  # blake3 为可选依赖
+    blake3 = None
+
+'''
+Merkle 树使用的 hash 算法
+
+所有算法的输入、输出都是字节串（32 字节的摘要），
+只有在需要展示或者兼容旧接口的时候，才转换为十六进制字符串。
+'''
+
+DIGEST_SIZE = 32  # 每个 hash 值所占的字节数
+
+
+def sha256_digest(data):
+    return hashlib.sha256(data).digest()
+
+
+def blake2b_digest(data):
+    return hashlib.blake2b(data, digest_size=32).digest()
+
+
+def blake3_digest(data):
+    return blake3.blake3(data).digest()
+
+
+HASH_BACKENDS = {
+    'sha256': sha256_digest,
+    'blake2b': blake2b_digest,
+}
+# 构造 hash 对象的函数，批量计算时直接调用，省去每个节点的函数调用开销
+HASH_CONSTRUCTORS = {
+    'sha256': hashlib.sha256,
+    'blake2b': partial(hashlib.blake2b, digest_size=32),
+}
+if blake3 != None:
+    HASH_BACKENDS['blake3'] = blake3_digest
+    HASH_CONSTRUCTORS['blake3'] = blake3.blake3
+
+
+def get_hash_backend(hashName='sha256'):
+    '''
+    函数功能：根据名字取出 hash 算法（输入字节串，输出 32 字节摘要）
+    '''
+    if hashName not in HASH_BACKENDS:
+        raise ValueError('不支持的 hash 算法：%s（可选：%s）' %
+                         (hashName, ', '.join(HASH_BACKENDS)))
+    return HASH_BACKENDS[hashName]
+
+
+def to_hex(digest):
+    '''
+    函数功能：把摘要转换为十六进制字符串（已经是字符串的原样返回）
+    '''
+    if digest == None or isinstance(digest, str):
+        return digest
+    return bytes(digest).hex()
+
+
+def hash_leaves(leafData, hashName='sha256'):
+    '''
+    函数功能：批量计算一组叶子数据（字符串）的摘要，返回首尾相连的摘要
+    '''
+    new = HASH_CONSTRUCTORS[hashName]
+    return b''.join([new(data.encode('utf-8')).digest() for data in leafData])
+
+
+def hash_records(data, offsets, start, stop, hashName='sha256'):
+    '''
+    函数功能：批量计算第 start ~ stop-1 条记录的摘要，第 i 条记录为 data[offsets[i]:offsets[i+1]]，返回首尾相连的摘要
+    data、offsets 可以是共享内存上的 memoryview，多进程构建时子进程直接读取，不需要复制叶子数据
+    '''
+    new = HASH_CONSTRUCTORS[hashName]
+    return b''.join([new(data[offsets[i]:offsets[i+1]]).digest() for i in range(start, stop)])
+
+
+def hash_level(children, hashName='sha256', batched=True):
+    '''
+    函数功能：一次计算一整层的父节点
+    参数：children 为首尾相连的孩子摘要（每个 DIGEST_SIZE 字节），
+         可以是 bytearray，也可以是提供 view() 的映射文件（MerkleStore.MappedLevel）
+    返回：首尾相连的父节点摘要；最后落单的孩子单独求 hash
+    batched 为 False 时，退回到逐对计算的 Python 循环
+    '''
+    pairBytes = 2 * DIGEST_SIZE
+    whole = len(children) - len(children) % pairBytes
+    if batched:
+        # struct.iter_unpack 在 C 中把整层切成一对一对的孩子，避免逐个切片
+        new = HASH_CONSTRUCTORS[hashName]
+        view = children.view() if hasattr(children, 'view') else memoryview(children)
+        pairs = struct.iter_unpack('%ds' % pairBytes, view[:whole])
+        parents = bytearray(b''.join([new(pair).digest() for (pair,) in pairs]))
+        del pairs
+        view.release()
+    else:
+        hashFunc = get_hash_backend(hashName)
+        parents = bytearray()
+        for start in range(0, whole, pairBytes):
+            parents += hashFunc(children[start:start+pairBytes])
+    if whole < len(children):
+        parents += get_hash_backend(hashName)(bytes(children[whole:]))
+    return parents
@@ -0,0 +1,267 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from MerkleHash import get_hash_backend
+from SparseMerkleTree import compute_sparse_root
+import math
+import struct
+import time
+
+'''
+Merkle 证明
+
+证明只包含一条从叶子到树根的路径上的兄弟节点，验证时不需要整棵树。
+'''
+
+MIN_BATCH = 2**10  # 证明少于这个数量时，不值得启动线程池 / 进程池
+LENGTH = struct.Struct('<I')  # 叶子 hash 值输入中，每一段之前的长度
+
+
+class MerkleProof:
+    '''
+    单个叶子的存在性证明
+    leafHash    叶子的 hash 值
+    path        自下而上的兄弟节点 [(hash, isLeft)]
+                isLeft 表示兄弟节点的位置在左边（即当前节点是右孩子）
+                hash 为 None 表示兄弟节点不存在（父节点只有一个孩子）
+    index       叶子的位置（由 path 中的左右关系决定）
+    treeSize    生成证明时树上叶子的数量
+    hashName    hash 算法
+    raw         hash 值是否为字节串（否则为十六进制字符串）
+    leafValue   叶子的数据（不存在性证明中使用，验证者需要比较大小）
+    leafKey     叶子标号，与 leafValue 一起按 leaf_data() 编码后得到叶子的 hash 值
+    '''
+
+    def __init__(self, leafHash, path, treeSize, hashName='sha256', raw=False, leafValue=None, leafKey=None):
+        self.leafHash = leafHash
+        self.leafValue = leafValue
+        self.leafKey = leafKey
+        self.path = path
+        self.treeSize = treeSize
+        self.hashName = hashName
+        self.raw = raw
+        self.index = 0
+        for depth, (_, isLeft) in enumerate(path):
+            if isLeft:
+                self.index |= 1 << depth
+
+    def __len__(self):
+        return len(self.path)
+
+    def __str__(self):
+        return 'MerkleProof(index='+str(self.index)+', treeSize='+str(self.treeSize)+', depth='+str(len(self.path))+')'
+
+
+def leaf_data(value, key):
+    '''
+    函数功能：叶子 hash 值的输入：数据和叶子标号按 UTF-8 编码，各自加上 4 字节的长度再拼接
+    直接拼接字符串时，数据的结尾和标号的开头可以互相挪动（'15' + '3...' == '153' + '...'），
+    加上长度之后，不同的 (value, key) 一定得到不同的输入
+    '''
+    value = value.encode('utf-8')
+    key = str(key).encode('utf-8')
+    return LENGTH.pack(len(value)) + value + LENGTH.pack(len(key)) + key
+
+
+def merge_hash(hashFunc, raw, left, right=None):
+    '''
+    函数功能：计算父节点的 hash 值（与 MerkleTree / FlatMerkleTree 的计算方式一致）
+    '''
+    data = left if right == None else left + right
+    if raw:
+        return hashFunc(data)
+    return hashFunc(data.encode('utf-8')).hex()
+
+
+def compute_root(proof):
+    '''
+    函数功能：由证明自下而上计算出树根的 hash 值
+    '''
+    hashFunc = get_hash_backend(proof.hashName)
+    thisHash = proof.leafHash
+    for sibling, isLeft in proof.path:
+        if sibling == None:
+            thisHash = merge_hash(hashFunc, proof.raw, thisHash)
+        elif isLeft:
+            thisHash = merge_hash(hashFunc, proof.raw, sibling, thisHash)
+        else:
+            thisHash = merge_hash(hashFunc, proof.raw, thisHash, sibling)
+    return thisHash
+
+
+def verify_proof(root, proof):
+    '''
+    函数功能：验证证明 proof 是否与树根的 hash 值 root 一致，不需要树本身
+    '''
+    if proof == None or root == None:
+        return False
+    return compute_root(proof) == root
+
+
+def verify_chunk(pairs):
+    '''
+    函数功能：依次验证一组 (root, proof)，在线程池 / 进程池中作为一个任务执行
+    '''
+    return [verify_proof(root, proof) for root, proof in pairs]
+
+
+def verify_proofs(pairs, workers=None, useProcess=False, stats=None):
+    '''
+    函数功能：批量验证 [(root, proof)]，返回对应的布尔值列表
+    只计算 hash，不修改证明，也不绘图
+    参数：workers     大于 1 时把证明分块交给线程池（useProcess 为 True 时用进程池）
+         stats       传入字典时，写入 proofs（数量）、seconds（耗时）、proofsPerSecond（吞吐量）
+    '''
+    pairs = list(pairs)
+    start = time.perf_counter()
+    if workers == None or workers <= 1 or len(pairs) < MIN_BATCH:
+        results = verify_chunk(pairs)
+    else:
+        # 每个 worker 分到几块，避免某一块拖慢整体
+        size = math.ceil(len(pairs) / (workers * 4))
+        chunks = [pairs[i:i+size] for i in range(0, len(pairs), size)]
+        executor = ProcessPoolExecutor if useProcess else ThreadPoolExecutor
+        with executor(max_workers=workers) as pool:
+            results = [result for chunk in pool.map(verify_chunk, chunks) for result in chunk]
+    cost = time.perf_counter() - start
+
+    if stats != None:
+        stats['proofs'] = len(pairs)
+        stats['seconds'] = cost
+        stats['proofsPerSecond'] = len(pairs) / cost if cost > 0 else 0.0
+    return results
+
+
+class MerkleMultiProof:
+    '''
+    多个叶子共用的存在性证明，每个需要的兄弟节点只出现一次
+    leaves      {叶子位置: 叶子的 hash 值}
+    siblings    [((层号, 位置), hash)]，按层号、位置排序；hash 为 None 表示该节点不存在
+    depth       树的高度（叶子为第 0 层，树根为第 depth 层）
+    treeSize    生成证明时树上叶子的数量
+    '''
+
+    def __init__(self, leaves, siblings, depth, treeSize, hashName='sha256', raw=False):
+        self.leaves = leaves
+        self.siblings = siblings
+        self.depth = depth
+        self.treeSize = treeSize
+        self.hashName = hashName
+        self.raw = raw
+
+    def __len__(self):
+        return len(self.siblings)
+
+    def __str__(self):
+        return 'MerkleMultiProof(leaves='+str(len(self.leaves))+', siblings='+str(len(self.siblings))+', treeSize='+str(self.treeSize)+')'
+
+
+def build_multiproof(pathNodes, hashOf, depth, treeSize, hashName='sha256', raw=False):
+    '''
+    函数功能：由若干条路径上的节点生成 MerkleMultiProof
+    参数：pathNodes 为路径上所有节点的位置 {(层号, 位置)}
+         hashOf(层号, 位置) 返回不在路径上的兄弟节点的 hash 值，节点不存在时返回 None
+    '''
+    leaves = {}
+    siblings = {}
+    for level, position in pathNodes:
+        if level == 0:
+            leaves[position] = hashOf(level, position)
+        if level < depth and (level, position ^ 1) not in pathNodes:
+            siblings[(level, position ^ 1)] = hashOf(level, position ^ 1)
+    return MerkleMultiProof(leaves, sorted(siblings.items()), depth, treeSize, hashName, raw)
+
+
+def compute_multiproof_root(proof):
+    '''
+    函数功能：由多叶子证明自下而上计算树根，每个共同的祖先只计算一次
+    返回：树根的 hash 值；证明不完整时返回 None
+    '''
+    hashFunc = get_hash_backend(proof.hashName)
+    siblings = dict(proof.siblings)
+    known = dict(proof.leaves)
+    if len(known) == 0:
+        return None
+
+    for level in range(proof.depth):
+        parents = {}
+        for position in sorted(known):
+            parent = position // 2
+            if parent in parents:
+                continue
+            children = []
+            for child in (2 * parent, 2 * parent + 1):
+                if child in known:
+                    children.append(known[child])
+                elif (level, child) in siblings:
+                    children.append(siblings[(level, child)])
+                else:
+                    # 缺少需要的兄弟节点
+                    return None
+            children = [child for child in children if child != None]
+            parents[parent] = merge_hash(hashFunc, proof.raw, *children)
+        known = parents
+
+    if list(known) != [0]:
+        return None
+    return known[0]
+
+
+def verify_multiproof(root, proof):
+    '''
+    函数功能：验证多叶子证明 proof 是否与树根的 hash 值 root 一致
+    '''
+    if proof == None or root == None:
+        return False
+    return compute_multiproof_root(proof) == root
+
+
+class AbsenceProof:
+    '''
+    有序树上某个值《不在》树上的证明
+    value       要证明不存在的值
+    indexProof  值索引（SparseMerkleTree，键为 str(int(value))）中这个键的不存在性证明（SparseMerkleProof）
+    treeHash    叶子所在的那棵树的树根 hash 值
+    树根为 H(treeHash || 值索引的树根)，与 MerkleTree.root_hash() 一致
+    '''
+
+    def __init__(self, value, indexProof, treeHash, treeSize, hashName='sha256', raw=False):
+        self.value = value
+        self.indexProof = indexProof
+        self.treeHash = treeHash
+        self.treeSize = treeSize
+        self.hashName = hashName
+        self.raw = raw
+
+    def __str__(self):
+        return 'AbsenceProof(value='+str(self.value)+', treeSize='+str(self.treeSize)+')'
+
+
+def verify_leaf_value(proof):
+    '''
+    函数功能：核对证明中的 leafValue、leafKey 与叶子的 hash 值一致
+    '''
+    if proof.leafValue == None or proof.leafKey == None:
+        return False
+    digest = get_hash_backend(proof.hashName)(leaf_data(proof.leafValue, proof.leafKey))
+    return (digest if proof.raw else digest.hex()) == proof.leafHash
+
+
+def verify_absent(root, proof):
+    '''
+    函数功能：验证不存在性证明，时间复杂度 O(depth)，与树上叶子的数量无关
+    1. 值索引中 str(int(value)) 对应的叶子为空（不存在性证明）
+    2. 由这个证明算出的值索引树根，与 treeHash 合并之后等于 root
+    '''
+    if proof == None or root == None:
+        return False
+    indexProof = proof.indexProof
+    if indexProof == None or indexProof.value != None or indexProof.hashName != proof.hashName:
+        return False
+    if indexProof.key != str(int(proof.value)):
+        return False
+
+    indexHash = compute_sparse_root(indexProof)
+    if indexHash == None:
+        return False
+    if not proof.raw:
+        indexHash = indexHash.hex()
+    return merge_hash(get_hash_backend(proof.hashName), proof.raw, proof.treeHash, indexHash) == root
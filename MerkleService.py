@@ -0,0 +1,116 @@
+from MerkleSnapshot import SnapshotMerkleTree
+import asyncio
+
+'''
+asyncio 形式的 Merkle 树服务
+
+await append(data)      在 window 秒之内到达的追加请求合并为一次 extend，
+                        每个受影响的祖先节点每批只计算一次 hash；extend 在线程池中执行，不阻塞事件循环
+await get_proof(key)    在最新发布的快照上生成证明，不需要等待正在进行的写操作
+'''
+
+
+class MerkleService:
+    '''
+    tree        SnapshotMerkleTree（默认新建一棵空树）
+    window      合并追加请求的时间窗口（秒）
+    maxBatch    一批最多合并的请求数量，达到之后立即写入
+    executor    执行写操作的线程池（None 为事件循环默认的线程池）
+    stats       appends（追加请求数）、batches（实际写入的批数）
+    '''
+
+    def __init__(self, tree=None, window=0.005, maxBatch=1024, executor=None):
+        self.tree = tree if tree != None else SnapshotMerkleTree()
+        self.window = window
+        self.maxBatch = maxBatch
+        self.executor = executor
+        self.pending = []      # [(data, future)]
+        self.flushTask = None  # 等待时间窗口结束的任务
+        self.tasks = set()     # 所有还没有结束的写入任务
+        self.stats = {'appends': 0, 'batches': 0}
+
+    async def append(self, data):
+        '''
+        函数功能：追加一个叶子，等这一批写入并发布之后返回新叶子的标号
+        同一批的请求合并为一次 extend，所以数据在排队之前就检查类型，不让一个错误的请求拖累整批
+        '''
+        if not isinstance(data, str):
+            raise TypeError('叶子数据必须是字符串：%s' % type(data).__name__)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((data, future))
+        self.stats['appends'] += 1
+
+        if len(self.pending) >= self.maxBatch:
+            # 达到一批的上限，立即取出这一批写入
+            self.cancel_timer()
+            self.schedule(self.write(self.take()))
+        elif self.flushTask == None:
+            self.flushTask = self.schedule(self.flush_later())
+        return await future
+
+    def schedule(self, coroutine):
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def cancel_timer(self):
+        if self.flushTask != None:
+            self.flushTask.cancel()
+            self.flushTask = None
+
+    def take(self):
+        '''
+        函数功能：取出所有等待中的追加请求作为一批
+        '''
+        batch, self.pending = self.pending, []
+        return batch
+
+    async def flush_later(self):
+        await asyncio.sleep(self.window)
+        self.flushTask = None
+        await self.write(self.take())
+
+    async def flush(self):
+        '''
+        函数功能：不再等待时间窗口，立即写入等待中的追加请求
+        '''
+        self.cancel_timer()
+        await self.write(self.take())
+
+    async def write(self, batch):
+        '''
+        函数功能：把一批追加请求作为一次 extend 写入树中（在线程池中执行）
+        '''
+        if len(batch) == 0:
+            return
+
+        self.stats['batches'] += 1
+        loop = asyncio.get_running_loop()
+        try:
+            keys = await loop.run_in_executor(self.executor, self.tree.extend, [data for data, _ in batch])
+        except Exception as error:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for (_, future), key in zip(batch, keys):
+            if not future.done():
+                future.set_result(key)
+
+    async def get_proof(self, key):
+        '''
+        函数功能：在最新发布的快照上生成标号为 key 的叶子的证明（不在快照中时返回 None）
+        '''
+        return self.tree.get_proof(key)
+
+    def root_hash(self):
+        return self.tree.root_hash()
+
+    async def close(self):
+        '''
+        函数功能：写入所有等待中的追加请求
+        '''
+        await self.flush()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
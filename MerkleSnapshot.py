@@ -0,0 +1,97 @@
+from MerkleTree import MerkleTree
+import threading
+import weakref
+
+'''
+读写并发的 Merkle 树（快照隔离）
+
+写操作由一把锁串行化，在 persistent 模式（写时复制）的 MerkleTree 上执行，
+完成之后把新的树根作为快照整体发布（一次属性赋值，对读者是原子的）。
+已经发布的节点不会再被修改，所以读者取得快照之后不需要任何锁，
+也不会看到写了一半的路径。
+'''
+
+
+class Snapshot:
+    '''
+    某一代树根的只读快照
+    indexHash 为有序树这一代值索引的树根（不是有序树时为 None）
+    '''
+
+    def __init__(self, root, generation, rootHash, indexHash=None):
+        self.root = root
+        self.generation = generation
+        self.rootHash = rootHash
+        self.indexHash = indexHash
+        self.size = root.childNum
+
+
+class SnapshotMerkleTree:
+    '''
+    单写者、多读者的 Merkle 树
+    写：build_merkle_tree / add / extend / update / remove（串行执行，完成后发布快照）
+    读：snapshot / root_hash / get_proof（针对同一个快照，不加锁；get_proof 查不到叶子时才加锁再查一次）
+    '''
+
+    def __init__(self, index='hash', hashName='sha256', raw=True):
+        self.tree = MerkleTree(index=index, hashName=hashName, raw=raw, persistent=True)
+        self.lock = threading.Lock()
+        self.published = weakref.WeakValueDictionary()  # 代数 -> 已经发布、仍被持有的快照
+        self.publish()
+
+    def publish(self):
+        '''
+        函数功能：发布当前的树根；读者仍然持有的旧快照由引用计数保留
+        在旧快照上查找叶子要用到它之后的删除、搬动记录，所以 tree 保留从最早的一个仍被持有的快照开始的版本
+        '''
+        tree = self.tree
+        self.snapshot = Snapshot(tree.root, tree.history, tree.root_hash(), tree.index_hash())
+        self.published[tree.history] = self.snapshot
+        tree.prune(min(self.published))
+
+    def write(self, operation, *args):
+        with self.lock:
+            result = operation(*args)
+            self.publish()
+        return result
+
+    def build_merkle_tree(self, nodeData, way='imbalance', sorted=False):
+        return self.write(self.tree.build_merkle_tree, nodeData, way, sorted)
+
+    def add(self, Data):
+        return self.write(self.tree.add, Data)
+
+    def extend(self, allData):
+        return self.write(self.tree.extend, allData)
+
+    def update(self, prime, Data):
+        return self.write(self.tree.update, prime, Data)
+
+    def remove(self, prime):
+        return self.write(self.tree.remove, prime)
+
+    def root_hash(self):
+        return self.snapshot.rootHash
+
+    def snapshot_path(self, snapshot, key):
+        '''
+        函数功能：快照中从树根到标号为 key 的叶子的路径
+        按叶子在快照那一代的位置自上而下查找（MerkleTree.find_path），不依赖只对最新版本有效的父亲指针
+        '''
+        path = self.tree.find_path(snapshot.root, key, snapshot.generation)
+        if path == None:
+            # 与写操作同时进行时，叶子当前的位置、搬动记录可能正在修改，加锁之后再查一次
+            with self.lock:
+                path = self.tree.find_path(snapshot.root, key, snapshot.generation)
+        return path
+
+    def get_proof(self, key, snapshot=None):
+        '''
+        函数功能：在快照上生成标号为 key 的叶子的存在性证明，快照中没有这个叶子时返回 None
+        '''
+        if snapshot == None:
+            snapshot = self.snapshot
+        path = self.snapshot_path(snapshot, key)
+        if path == None:
+            return None
+        return self.tree.path_proof(path, snapshot.indexHash)
@@ -0,0 +1,299 @@
+from FlatMerkleTree import FlatMerkleTree
+from MerkleHash import DIGEST_SIZE
+import json
+import logging
+import mmap
+import os
+import struct
+
+'''
+FlatMerkleTree 的磁盘存储
+
+每一层的 hash 值保存在一个内存映射文件中（level_<层号>.bin），叶子数据保存在
+leaves.idx（每个叶子的起始位置和长度）与 leaves.dat（UTF-8 编码的数据）中。
+重新打开时只映射文件，不读取内容，页面在证明访问到的时候才由操作系统载入；
+之后的 add / update / remove 直接写入映射的文件。
+'''
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('<Q')    # 文件头：有效数据的字节数
+RECORD = struct.Struct('<QQ')   # 叶子索引：数据在 leaves.dat 中的起始位置、长度
+
+
+class MappedLevel:
+    '''
+    内存映射文件中的一段字节，接口与 FlatMerkleTree 使用的 bytearray 一致
+    （len、切片读写、末尾追加 +=、删除末尾 del level[start:]）
+    文件按 2 倍扩容，有效长度记录在文件头中
+    '''
+
+    def __init__(self, path, data=None):
+        if data != None or not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(HEADER.pack(len(data or b'')))
+                f.write(data or b'')
+        self.path = path
+        self.file = open(path, 'r+b')
+        self.mmap = mmap.mmap(self.file.fileno(), 0)
+        self.size = HEADER.unpack_from(self.mmap, 0)[0]
+
+    def __len__(self):
+        return self.size
+
+    def view(self):
+        '''
+        函数功能：有效数据的 memoryview（不复制），用完之后需要释放才能扩容
+        '''
+        return memoryview(self.mmap)[HEADER.size:HEADER.size+self.size]
+
+    def bounds(self, key):
+        if not isinstance(key, slice):
+            raise TypeError('MappedLevel 只支持切片访问')
+        start, stop, step = key.indices(self.size)
+        if step != 1:
+            raise ValueError('MappedLevel 不支持步长')
+        return HEADER.size + start, HEADER.size + max(start, stop)
+
+    def __getitem__(self, key):
+        start, stop = self.bounds(key)
+        return self.mmap[start:stop]
+
+    def __setitem__(self, key, data):
+        start, stop = self.bounds(key)
+        if stop - start != len(data):
+            raise ValueError('MappedLevel 不能通过切片赋值改变长度')
+        self.mmap[start:stop] = data
+
+    def __iadd__(self, data):
+        end = HEADER.size + self.size + len(data)
+        if end > len(self.mmap):
+            self.mmap.resize(max(end, 2 * len(self.mmap)))
+        self.mmap[end-len(data):end] = data
+        self.resize(self.size + len(data))
+        return self
+
+    def __delitem__(self, key):
+        start, stop = self.bounds(key)
+        if stop != HEADER.size + self.size:
+            raise ValueError('MappedLevel 只能删除末尾的数据')
+        self.resize(start - HEADER.size)
+
+    def resize(self, size):
+        self.size = size
+        HEADER.pack_into(self.mmap, 0, size)
+
+    def flush(self):
+        self.mmap.flush()
+
+    def close(self):
+        self.mmap.close()
+        self.file.close()
+
+
+class MappedLevels:
+    '''
+    所有层的列表，接口与 FlatMerkleTree.levels（bytearray 的列表）一致
+    追加一层时新建文件，删除高层时删除对应的文件
+    '''
+
+    def __init__(self, directory, levels=None):
+        self.directory = directory
+        self.items = []
+        if levels != None:
+            self.clear()
+            for level in levels:
+                self.append(level)
+            return
+        while os.path.exists(self.level_path(len(self.items))):
+            self.items.append(MappedLevel(self.level_path(len(self.items))))
+
+    def level_path(self, level):
+        return os.path.join(self.directory, 'level_%d.bin' % level)
+
+    def clear(self):
+        level = 0
+        while os.path.exists(self.level_path(level)):
+            os.remove(self.level_path(level))
+            level += 1
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __getitem__(self, level):
+        return self.items[level]
+
+    def __setitem__(self, level, data):
+        # self.levels[0] += digest 会先原地追加，再把同一个对象赋值回来
+        thisLevel = self.items[level]
+        if data is thisLevel:
+            return
+        del thisLevel[0:]
+        thisLevel += data
+
+    def append(self, data):
+        self.items.append(MappedLevel(self.level_path(len(self.items)), bytes(data)))
+
+    def __delitem__(self, key):
+        if not isinstance(key, slice):
+            key = slice(key, key + 1)
+        for thisLevel in self.items[key]:
+            thisLevel.close()
+            os.remove(thisLevel.path)
+        del self.items[key]
+
+    def flush(self):
+        for thisLevel in self.items:
+            thisLevel.flush()
+
+    def close(self):
+        for thisLevel in self.items:
+            thisLevel.close()
+
+
+class MappedRecords:
+    '''
+    叶子数据（字符串）的列表，接口与 FlatMerkleTree.leafData 一致
+    修改某个叶子时，新数据追加到 leaves.dat 末尾，旧数据不再回收
+    '''
+
+    def __init__(self, directory, leafData=None):
+        indexPath = os.path.join(directory, 'leaves.idx')
+        dataPath = os.path.join(directory, 'leaves.dat')
+        if leafData == None:
+            self.index = MappedLevel(indexPath)
+            self.data = MappedLevel(dataPath)
+            return
+
+        # 一次写入所有叶子
+        index = bytearray()
+        data = bytearray()
+        for value in leafData:
+            value = value.encode('utf-8')
+            index += RECORD.pack(len(data), len(value))
+            data += value
+        self.index = MappedLevel(indexPath, index)
+        self.data = MappedLevel(dataPath, data)
+
+    def __len__(self):
+        return len(self.index) // RECORD.size
+
+    def position(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('叶子下标越界')
+        return i * RECORD.size
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        position = self.position(i)
+        start, length = RECORD.unpack(self.index[position:position+RECORD.size])
+        return self.data[start:start+length].decode('utf-8')
+
+    def __setitem__(self, i, value):
+        position = self.position(i)
+        value = value.encode('utf-8')
+        self.index[position:position+RECORD.size] = RECORD.pack(len(self.data), len(value))
+        self.data += value
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, value):
+        value = value.encode('utf-8')
+        self.index += RECORD.pack(len(self.data), len(value))
+        self.data += value
+
+    def extend(self, allValue):
+        for value in allValue:
+            self.append(value)
+
+    def pop(self):
+        value = self[-1]
+        position = self.position(-1)
+        start, length = RECORD.unpack(self.index[position:])
+        del self.index[position:]
+        if start + length == len(self.data):
+            del self.data[start:]
+        return value
+
+    def flush(self):
+        self.index.flush()
+        self.data.flush()
+
+    def close(self):
+        self.index.close()
+        self.data.close()
+
+
+class MerkleStore:
+    '''
+    目录形式的 FlatMerkleTree 存储
+    save(tree)  把树写入目录，并让树直接使用映射的文件（之后的修改直接写入磁盘）
+    load()      打开目录中的树，只映射文件，时间与树的大小无关
+    说明：对已保存的树重新调用 build_merkle_tree 会回到内存中，需要再次 save
+    '''
+
+    def __init__(self, path):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.metaPath = os.path.join(path, 'meta.json')
+        self.levels = None
+        self.leafData = None
+
+    def save(self, tree):
+        # 树可能正使用这个目录中的文件，先把数据取出来再重写
+        levels = [bytes(level[0:]) for level in tree.levels]
+        leafData = list(tree.leafData)
+        self.close()
+        with open(self.metaPath, 'w') as f:
+            json.dump({'hashName': tree.hashName, 'way': tree.way, 'digestSize': DIGEST_SIZE}, f)
+        self.levels = MappedLevels(self.path, levels)
+        self.leafData = MappedRecords(self.path, leafData)
+        tree.levels = self.levels
+        tree.leafData = self.leafData
+        return tree
+
+    def load(self, batched=True):
+        if not os.path.exists(self.metaPath):
+            logger.warning('这个目录中没有保存的树')
+            return None
+        with open(self.metaPath) as f:
+            meta = json.load(f)
+        self.close()
+        tree = FlatMerkleTree(hashName=meta['hashName'], batched=batched)
+        tree.way = meta['way']
+        self.levels = MappedLevels(self.path)
+        self.leafData = MappedRecords(self.path)
+        tree.levels = self.levels
+        tree.leafData = self.leafData
+        return tree
+
+    def flush(self):
+        '''
+        函数功能：把映射文件中修改过的页面写回磁盘
+        '''
+        if self.levels != None:
+            self.levels.flush()
+            self.leafData.flush()
+
+    def close(self):
+        if self.levels != None:
+            self.flush()
+            self.levels.close()
+            self.leafData.close()
+            self.levels = None
+            self.leafData = None
+
+
+def open_tree(path, batched=True):
+    '''
+    函数功能：打开保存在目录 path 中的 FlatMerkleTree
+    '''
+    return MerkleStore(path).load(batched)
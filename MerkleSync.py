@@ -0,0 +1,245 @@
+from MerkleCodec import LAYOUT_NAMES, LAYOUTS
+from MerkleDiff import VIRTUAL, flat_node, merge_ranges
+from MerkleHash import DIGEST_SIZE
+import asyncio
+import math
+import struct
+
+'''
+FlatMerkleTree 副本之间的同步
+
+本地副本向远端副本逐层请求子树的 hash 值，与本地比较之后只继续请求不同的子树，
+最后只传输不同（或缺少）的叶子。每一层只需要一次往返，总往返次数为 树高 + 2。
+远端由 MerklePeer 处理请求，请求与回应都是字节串，通过可替换的传输层（Transport）发送：
+    LoopbackTransport   进程内直接调用对端（测试用）
+    StreamTransport     asyncio 的 TCP 连接，对端用 serve_peer() 启动
+
+说明：只支持 imbalance 方式构建的树（filling 方式补充的叶子 hash 值不是由数据计算的），
+      远端在 INFO 中回应自己的构造方式，任何一端是 filling 时，sync() 在修改本地之前就报错
+'''
+
+REQUEST_INFO = b'I'     # 叶子数量、树高、构造方式、树根
+REQUEST_HASHES = b'H'   # 某一层若干个节点的 hash 值
+REQUEST_LEAVES = b'L'   # 若干个区间的叶子数据
+
+INFO = struct.Struct('<QBB')
+COUNT = struct.Struct('<I')
+LEVEL = struct.Struct('<B')
+INDEX = struct.Struct('<Q')
+RANGE = struct.Struct('<QQ')
+
+
+def pack_strings(allValue):
+    chunks = [COUNT.pack(len(allValue))]
+    for value in allValue:
+        value = value.encode('utf-8')
+        chunks.append(COUNT.pack(len(value)))
+        chunks.append(value)
+    return b''.join(chunks)
+
+
+def unpack_strings(data):
+    (count,) = COUNT.unpack_from(data, 0)
+    offset = COUNT.size
+    allValue = []
+    for _ in range(count):
+        (size,) = COUNT.unpack_from(data, offset)
+        offset += COUNT.size
+        allValue.append(bytes(data[offset:offset+size]).decode('utf-8'))
+        offset += size
+    return allValue
+
+
+class MerklePeer:
+    '''
+    同步的远端：只读地回答对 tree（FlatMerkleTree）的请求
+    '''
+
+    def __init__(self, tree):
+        self.tree = tree
+
+    def handle(self, data):
+        '''
+        函数功能：处理一个请求，返回回应的字节串
+        '''
+        kind, body = data[:1], memoryview(data)[1:]
+        tree = self.tree
+        if kind == REQUEST_INFO:
+            return INFO.pack(len(tree), tree.depth(), LAYOUTS[tree.way]) + (tree.root_hash() or bytes(DIGEST_SIZE))
+
+        if kind == REQUEST_HASHES:
+            (level,) = LEVEL.unpack_from(body, 0)
+            indexes = [index for (index,) in INDEX.iter_unpack(body[LEVEL.size:])]
+            return b''.join([tree.node_hash(level, index) for index in indexes])
+
+        if kind == REQUEST_LEAVES:
+            allValue = []
+            for start, stop in RANGE.iter_unpack(body):
+                allValue.extend(tree.leafData[start:stop])
+            return pack_strings(allValue)
+
+        raise ValueError('未知的请求：%r' % kind)
+
+
+class Transport:
+    '''
+    传输层接口：把请求发给对端，等待回应
+    '''
+
+    async def request(self, data):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class LoopbackTransport(Transport):
+    '''
+    进程内的传输层：经过 asyncio 调度后直接调用对端，latency 为模拟的单程延迟（秒）
+    '''
+
+    def __init__(self, peer, latency=0):
+        self.peer = peer
+        self.latency = latency
+
+    async def request(self, data):
+        await asyncio.sleep(self.latency)
+        response = self.peer.handle(bytes(data))
+        await asyncio.sleep(self.latency)
+        return response
+
+
+class StreamTransport(Transport):
+    '''
+    asyncio TCP 连接上的传输层，每条消息前加 4 字节的长度
+    '''
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def request(self, data):
+        self.writer.write(COUNT.pack(len(data)) + data)
+        await self.writer.drain()
+        return await read_frame(self.reader)
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def read_frame(reader):
+    (size,) = COUNT.unpack(await reader.readexactly(COUNT.size))
+    return await reader.readexactly(size)
+
+
+async def serve_peer(peer, host='127.0.0.1', port=0):
+    '''
+    函数功能：在 TCP 端口上提供 MerklePeer，返回 asyncio 的 Server
+    '''
+    async def on_connect(reader, writer):
+        try:
+            while True:
+                response = peer.handle(await read_frame(reader))
+                writer.write(COUNT.pack(len(response)) + response)
+                await writer.drain()
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(on_connect, host, port)
+
+
+async def sync(local, transport, stats=None):
+    '''
+    函数功能：把本地的 FlatMerkleTree 同步为与远端一致，只传输不同的叶子
+    参数：stats 传入字典时，写入 roundTrips（往返次数）、bytesSent、bytesReceived、leaves（传输的叶子数）
+    返回：更新过的叶子区间 [(start, stop)]
+    '''
+    if local.way != 'imbalance':
+        raise ValueError('只支持 imbalance 方式构建的树，本地为 %s' % local.way)
+    if stats == None:
+        stats = {}
+    stats.update(roundTrips=0, bytesSent=0, bytesReceived=0, leaves=0)
+
+    async def call(data):
+        response = await transport.request(data)
+        stats['roundTrips'] += 1
+        stats['bytesSent'] += len(data)
+        stats['bytesReceived'] += len(response)
+        return response
+
+    response = await call(REQUEST_INFO)
+    remoteSize, remoteDepth, remoteLayout = INFO.unpack_from(response, 0)
+    remoteRoot = bytes(response[INFO.size:])
+    if LAYOUT_NAMES.get(remoteLayout) != 'imbalance':
+        raise ValueError('只支持 imbalance 方式构建的树，远端为 %s' % LAYOUT_NAMES.get(remoteLayout, remoteLayout))
+    if remoteSize == len(local) and (remoteSize == 0 or remoteRoot == local.root_hash()):
+        return []
+
+    def remote_exists(level, index):
+        # 远端节点是否存在可以由叶子数量算出来，不需要请求
+        if remoteSize == 0:
+            return False
+        if level > remoteDepth:
+            return index == 0
+        return index < math.ceil(remoteSize / 2**level)
+
+    # 逐层缩小范围，每一层一次往返
+    ranges = []
+    level = max(local.depth(), remoteDepth)
+    frontier = [0]
+    while len(frontier) != 0:
+        ask = [index for index in frontier if remote_exists(level, index) and level <= remoteDepth]
+        remoteHashes = {}
+        if len(ask) != 0:
+            response = await call(REQUEST_HASHES + LEVEL.pack(level) + b''.join([INDEX.pack(index) for index in ask]))
+            for i, index in enumerate(ask):
+                remoteHashes[index] = bytes(response[i*DIGEST_SIZE:(i+1)*DIGEST_SIZE])
+
+        nextFrontier = []
+        for index in frontier:
+            if not remote_exists(level, index):
+                continue
+            localHash = flat_node(local, level, index)
+            remoteHash = remoteHashes.get(index, VIRTUAL)
+            if localHash == None:
+                # 本地没有这棵子树，整棵取回
+                ranges.append((index << level, min((index + 1) << level, remoteSize)))
+            elif remoteHash != VIRTUAL and localHash == remoteHash:
+                continue
+            elif level == 0:
+                ranges.append((index, index + 1))
+            else:
+                nextFrontier.extend([2 * index, 2 * index + 1])
+        frontier = nextFrontier
+        level -= 1
+
+    # 一次取回所有不同的叶子
+    ranges = merge_ranges(ranges)
+    allValue = []
+    if len(ranges) != 0:
+        response = await call(REQUEST_LEAVES + b''.join([RANGE.pack(start, stop) for start, stop in ranges]))
+        allValue = unpack_strings(response)
+    stats['leaves'] = len(allValue)
+
+    # 应用到本地：修改已有的叶子，追加缺少的叶子，删除多余的叶子
+    values = iter(allValue)
+    for start, stop in ranges:
+        for index in range(start, stop):
+            if index < len(local):
+                local.update(index, next(values))
+            else:
+                local.add(next(values))
+    while len(local) > remoteSize:
+        local.remove(len(local) - 1)
+
+    if remoteSize != 0 and local.root_hash() != remoteRoot:
+        raise ValueError('同步之后树根仍然不一致')
+    return ranges
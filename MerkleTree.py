@@ -1,8 +1,14 @@
-from Crypto.Hash import SHA256
 from graphviz import Digraph
+from MerkleHash import get_hash_backend, to_hex
+from MerkleProof import AbsenceProof, MerkleProof, build_multiproof, leaf_data
+from SparseMerkleTree import SparseMerkleTree
+from collections import deque
+from itertools import compress, islice
 from random import randint
 import copy
+import logging
 import math
+import threading
 import time
 
 from graphviz.dot import node
@@ -14,29 +20,143 @@ from graphviz.dot import node
 创建一棵 Merkle 树
 '''
 
+logger = logging.getLogger(__name__)
+
 
 class TreeNode:
     '''
     树节点类
     '''
 
-    def __init__(self, value, leftNode=None, rightNode=None, hash=None, childNum=None, depth=None, id=None, father=None, primeNum=None, hashIsRight=True, generation=None,):
+    def __init__(self, value, leftNode=None, rightNode=None, hash=None, childNum=None, depth=None, id=None, father=None, primeNum=None, hashIsRight=True, generation=None, leftLeaf=None, rightLeaf=None, moves=(),):
         self.value = value              # 节点保存的数据
         self.leftNode = leftNode        # 节点的左孩子
         self.rightNode = rightNode      # 节点的右孩子
         self.hash = hash                # hash值
         self.childNum = childNum        # 节点拥有的孩子数量
         self.depth = depth              # 节点的高度
-        self.id = id                    # 唯一的标号
+        self.id = id                    # 树内唯一的标号（递增的整数）
         self.father = father            # 父亲节点
         self.primeNum = primeNum        # 大素数
         self.hashIsRight = hashIsRight  # 该节点的hash值是否正确
         self.generation = generation    # 该节点的添加代
+        self.leftLeaf = leftLeaf        # 子树最左边的叶子（中间节点使用）
+        self.rightLeaf = rightLeaf      # 子树最右边的叶子（中间节点使用）
+        self.moves = moves              # 叶子内容的搬动记录 ((代数, 这一代之前的位置), ...)，新的在前
         # self.rm = rm
 
     def __str__(self):
-        # 可以打印树中某个节点的信息
-        return 'Node(value='+self.value+', prime='+self.primeNum+', hash='+self.hash+')'
+        # 可以打印树中某个节点的信息（素数之积太大时只打印位数）
+        prime = self.primeNum
+        if isinstance(prime, int) and prime.bit_length() > 64:
+            prime = '<%d bits>' % prime.bit_length()
+        return 'Node(value='+self.label()+', prime='+str(prime)+', hash='+to_hex(self.hash)+')'
+
+    def label(self):
+        '''
+        函数功能：节点展示用的数据
+        中间节点不再保存所有叶子数据拼接起来的字符串，只保存叶子范围，展示时再生成
+        '''
+        if self.value != None:
+            return self.value
+        if self.leftLeaf == None:
+            return ''
+        if self.leftLeaf == self.rightLeaf:
+            return self.leftLeaf.value
+        return self.leftLeaf.value + ' ~ ' + self.rightLeaf.value
+
+
+class PrimeTable:
+    '''
+    用埃氏筛预先计算的素数表，第 n 个叶子直接取第 n 个素数，不需要素性检验，也不会重复
+    表不够用时把筛的范围加倍，重新筛一遍（均摊 O(1)）
+    '''
+
+    def __init__(self, limit=2**16):
+        self.lock = threading.Lock()
+        self.primes = []
+        self.limit = 0
+        self.extend(limit)
+
+    def extend(self, limit):
+        sieve = bytearray([1]) * (limit + 1)
+        sieve[0:2] = b'\x00\x00'
+        for p in range(2, math.isqrt(limit) + 1):
+            if sieve[p]:
+                sieve[p*p::p] = bytes(len(range(p*p, limit + 1, p)))
+        self.primes = list(compress(range(limit + 1), sieve))
+        self.limit = limit
+
+    def __getitem__(self, n):
+        if n >= len(self.primes):
+            with self.lock:
+                while n >= len(self.primes):
+                    self.extend(self.limit * 2)
+        return self.primes[n]
+
+
+PRIMES = PrimeTable()
+
+# 叶子自身的内容，删除时由最后一个叶子搬到被删除的位置上（hash 值由这些内容决定，移动后不需要重新计算）
+LEAF_FIELDS = ('value', 'hash', 'primeNum', 'id', 'generation', 'moves')
+
+# 有序树值索引（SparseMerkleTree）的高度：每次修改重新计算 VALUE_INDEX_DEPTH 个 hash，
+# n 个不同的值发生位置冲突的概率约为 n^2 / 2^65（冲突时修改报错，树保持不变）
+VALUE_INDEX_DEPTH = 64
+
+
+def iter_level_order(node):
+    '''
+    函数功能：层次遍历以 node 为根的（子）树，逐个返回节点
+    使用 deque 出队，时间复杂度 O(1)；list.pop(0) 每次都要移动整个列表，遍历整棵树是 O(n^2)
+    '''
+    if node == None:
+        return
+    queue = deque([node])
+    while queue:
+        thisNode = queue.popleft()
+        yield thisNode
+        if thisNode.leftNode:
+            queue.append(thisNode.leftNode)
+        if thisNode.rightNode:
+            queue.append(thisNode.rightNode)
+
+
+def iter_levels(node):
+    '''
+    函数功能：自上而下逐层返回以 node 为根的（子）树的节点列表
+    '''
+    level = [node] if node != None else []
+    while len(level) != 0:
+        yield level
+        level = [child for thisNode in level for child in (thisNode.leftNode, thisNode.rightNode) if child]
+
+
+def iter_leaves(node):
+    '''
+    函数功能：从左到右逐个返回叶子（深度优先的生成器，调用者可以提前停止）
+    栈中最多保存一条路径上的右孩子，返回前 k 个叶子的代价为 O(k + log n)
+    叶子都在同一深度时，顺序与层次遍历相同
+    '''
+    stack = [node] if node != None else []
+    while stack:
+        thisNode = stack.pop()
+        if thisNode.leftNode == None and thisNode.rightNode == None:
+            yield thisNode
+            continue
+        if thisNode.rightNode:
+            stack.append(thisNode.rightNode)
+        if thisNode.leftNode:
+            stack.append(thisNode.leftNode)
+
+
+def iter_root_path(node):
+    '''
+    函数功能：从 node 开始沿父亲指针走到树根，逐个返回路径上的节点
+    '''
+    while node != None:
+        yield node
+        node = node.father
 
 
 class MerkleTree:
@@ -44,29 +164,86 @@ class MerkleTree:
     Merkle 树用于保证数据的完整性
     一、查询某一个元素是否《存在》树上
     二、查询某一个元素是否《不在》树上
+
+    index 为叶子的成员索引方式：
+        'prime' 每个叶子一个素数（按顺序从素数表中分配），父节点保存孩子素数之积（默认，兼容旧版本）
+        'hash'  叶子使用顺序编号，中间节点不保存成员索引
+    两种方式都通过叶子字典 leafIndex（叶子标号 -> 叶子节点）定位叶子，成员判断只查这个字典
+    hashName 为 hash 算法（sha256 / blake2b / blake3）
+    raw 为 True 时，节点保存 32 字节的摘要，父节点直接对 left || right 两个摘要求 hash；
+        为 False 时保存十六进制字符串（兼容旧版本）
+    build_merkle_tree(sorted=True) 构建的有序树，另外维护一个按 int(value) 的值索引（SparseMerkleTree），
+        可以用 prove_absent 生成《不在》树上的证明。叶子的位置与其它叶子的值无关（与普通的树一样按添加顺序），
+        add / update / remove 为 O(log n + VALUE_INDEX_DEPTH)；树根为 H(叶子树的树根 || 值索引的树根)
+    persistent 为 True 时，每次修改只复制路径上的节点（写时复制），每一代的树根保存在 versions 中，
+        可以对历史版本生成证明；父亲指针只对当前版本有效
     '''
 
-    def __init__(self):
+    def __init__(self, index='prime', hashName='sha256', raw=False, persistent=False):
         self.history = 1  # 创建节点的代数，初始化为第一代节点
         self.newNodes = []
-        self.root = TreeNode(
+        self.index = index
+        self.hashName = hashName
+        self.hashFunc = get_hash_backend(hashName)
+        self.raw = raw
+        self.emptyHash = b'' if raw else ''  # 空节点的 hash 值
+        self.leafIndex = {}  # 叶子标号 -> 叶子节点
+        self.nextKey = 1     # 下一个顺序编号（'prime' 模式下为素数表中的序号）
+        self.sorted = False  # 是否维护按 int(value) 的值索引
+        self.valueIndex = None  # 值索引：str(int(value)) -> 这个值的叶子数量（sorted=True 时使用）
+        self.indexRoots = {}    # 代数 -> 这一代值索引的树根（persistent=True 且 sorted=True 时使用）
+        self.way = 'filling'
+        self.persistent = persistent
+        self.versions = {}   # 代数 -> 这一代的树根（persistent=True 时使用）
+        self.removedLeaves = {}         # 被删除的叶子标号 -> (删除的代数, 删除前的位置, 搬动记录)（persistent=True 时使用）
+        self.removedOrder = deque()     # 按代数排列的 (删除的代数, 叶子标号)，用于丢弃不再需要的删除记录
+        self.pruned = 0                 # 第 pruned 代及之前的版本已经丢弃
+        self.nextId = 1      # 下一个节点标号
+        self.hashCount = 0   # 累计计算 hash 的次数（用于日志中的操作摘要）
+        self.root = self.empty_root()
+
+    def log_summary(self, operation, leaves, start, hashCount):
+        '''
+        函数功能：在 INFO 级别记录一次操作的摘要：涉及的叶子数量、耗时、这次操作计算 hash 的次数
+        '''
+        if logger.isEnabledFor(logging.INFO):
+            logger.info('%s：%d 个叶子（树中共 %d 个），耗时 %.6f 秒，计算 %d 次 hash',
+                        operation, leaves, len(self.leafIndex), time.perf_counter() - start,
+                        self.hashCount - hashCount)
+
+    def new_node(self, **fields):
+        '''
+        函数功能：创建一个节点，并分配树内唯一的标号（递增的整数）
+        '''
+        node = TreeNode(id=self.nextId, **fields)
+        self.nextId += 1
+        return node
+
+    def empty_root(self):
+        '''
+        函数功能：生成 Merkle 树的初始状态（树桩）
+        '''
+        return self.new_node(
             value='root',
-            hash='',
+            hash=self.emptyHash,
             childNum=0,
             depth=0,
-            id=str(time.time()),
             generation=self.history,
-            primeNum=self.generate_prime_number()
+            primeNum='1' if self.index == 'prime' else None  # 没有叶子，素数之积为 1
         )
 
     def calculate_hash(self, data):
         '''
-        函数功能：计算hash值（SHA256）
+        函数功能：计算hash值（默认 SHA256）
+        字符串输入按 UTF-8 编码；raw 模式下返回摘要本身，否则返回十六进制字符串
         '''
-        bytes_data = bytearray(data, "utf-8")
-        h = SHA256.new()
-        h.update(bytes_data)
-        return str(h.hexdigest())
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        digest = self.hashFunc(data)
+        self.hashCount += 1
+        if self.raw:
+            return digest
+        return digest.hex()
 
     def miller_rabin(self, p):
         '''
@@ -114,6 +291,118 @@ class MerkleTree:
             num = num + 1
         return str(num)
 
+    def generate_leaf_key(self, rootPrime=1):
+        '''
+        函数功能：为新的叶子分配一个标号，时间复杂度 O(1)，同一棵树中不会重复
+        'prime' 模式：依次取素数表中的下一个素数
+        'hash'  模式：顺序编号
+        rootPrime 不再需要（以前用于排除重复的素数），保留只为兼容旧的调用方式
+        '''
+        key = self.nextKey
+        self.nextKey += 1
+        if self.index == 'prime':
+            return str(PRIMES[key - 1])
+        return str(key)
+
+    def register_leaf(self, node):
+        '''
+        函数功能：登记一个新的叶子（写入叶子字典）
+        '''
+        self.leafIndex[node.primeNum] = node
+
+    def merge_key(self, node):
+        '''
+        函数功能：由孩子节点计算 node 的成员索引
+        'prime' 模式为孩子素数之积，'hash' 模式没有（定位、判断叶子都通过叶子字典）
+        '''
+        if self.index == 'hash':
+            return
+
+        # 中间节点的素数之积保存为整数：叶子很多时转换为十进制字符串的代价是平方级的
+        MergePrime = 1
+        if node.leftNode:
+            MergePrime = int(node.leftNode.primeNum)
+        if node.rightNode:
+            MergePrime = MergePrime * int(node.rightNode.primeNum)
+        node.primeNum = MergePrime
+
+    def merge_node(self, node):
+        '''
+        函数功能：由孩子节点重新计算 node 的数据、hash 值和成员索引
+        '''
+        MergeHash = self.emptyHash
+        if node.leftNode != None:
+            MergeHash = node.leftNode.hash
+        if node.rightNode != None:
+            MergeHash = MergeHash + node.rightNode.hash
+
+        node.hash = self.calculate_hash(MergeHash)
+        self.merge_range(node)
+        self.merge_key(node)
+
+    def merge_range(self, node):
+        '''
+        函数功能：由孩子节点计算 node 子树的叶子范围（最左、最右的叶子）
+        '''
+        node.value = None
+        node.leftLeaf = None
+        node.rightLeaf = None
+        first = node.leftNode or node.rightNode
+        last = node.rightNode or node.leftNode
+        if first != None:
+            node.leftLeaf = first.leftLeaf or first
+            node.rightLeaf = last.rightLeaf or last
+
+    def has_leaf(self, key):
+        '''
+        函数功能：判断标号为 key 的叶子是否在这棵树上
+        '''
+        return str(key) in self.leafIndex
+
+    def locate_path(self, key):
+        '''
+        函数功能：返回从树根到标号为 key 的叶子的路径（节点列表）
+        通过叶子字典直接找到叶子，再沿着父亲节点走到树根，时间复杂度 O(log n)
+        '''
+        path = list(iter_root_path(self.leafIndex[str(key)]))
+        path.reverse()
+        return path
+
+    def leaf_position(self, leaf):
+        '''
+        函数功能：当前版本中叶子 leaf 的位置（从左到右的序号），沿父亲节点向上走，时间复杂度 O(log n)
+        '''
+        position, level = 0, 0
+        father = leaf.father
+        while father != None:
+            if father.rightNode == leaf:
+                position |= 1 << level
+            leaf, father = father, father.father
+            level += 1
+        return position
+
+    def position_at(self, key, generation):
+        '''
+        函数功能：标号为 key 的叶子在第 generation 代中的位置，不在那一代中时返回 None（也可能返回错误的位置，由调用者核对标号）
+        叶子只在删除时被搬动（最后一个叶子填补空位），从当前位置（或删除前的位置）出发，
+        按搬动记录倒推回那一代，时间复杂度 O(log n + 搬动次数)
+        '''
+        key = str(key)
+        leaf = self.leafIndex.get(key)
+        if leaf != None:
+            position, moves = self.leaf_position(leaf), leaf.moves
+        elif key in self.removedLeaves:
+            removedGeneration, position, moves = self.removedLeaves[key]
+            if generation >= removedGeneration:
+                return None
+        else:
+            return None
+        for moveGeneration, oldPosition in moves:
+            if generation >= moveGeneration:
+                break
+            position = oldPosition
+        return position
+
     def bulid_complete_binary_tree(self, treeNodeData):
         '''
         功能：构造一颗完全二叉树
@@ -125,40 +414,28 @@ class MerkleTree:
         # 计算能构造一颗完全二叉树所需要的节点数量
         treeDepth = math.ceil(math.log2(len(treeNodeData)))
 
-        # 为整棵树补充需要的节点（将最后一个节点复制若干次）
-        for _ in range(2**treeDepth - len(treeNodeData)):
-            copyNodeString = treeNodeData[len(treeNodeData)-1].value
-            copyNodeHash = treeNodeData[len(treeNodeData)-1].hash
-            copyNode = TreeNode(
-                value=copyNodeString,
-                hash=self.calculate_hash(copyNodeHash),
-                depth=0,
-                childNum=0,
-                id=str(time.time()),
-                primeNum=self.generate_prime_number(),
-                generation=self.history,
-            )
-            treeNodeData.append(copyNode)
+        # 为整棵树补充需要的节点（将最后一个节点的数据复制若干次）
+        # 补齐的叶子与普通叶子一样，hash 值由数据和自己的标号计算，解码时可以逐个验证
+        copyNodeString = treeNodeData[len(treeNodeData)-1].value
+        treeNodeData.extend(self.make_leaves([copyNodeString] * (2**treeDepth - len(treeNodeData))))
 
         # 构造所有的中间节点 -> nodeQueue
         nodeQueue = []
         for index in range(0, len(treeNodeData), 2):
-            mergeStrings = treeNodeData[index].value + \
-                ' '+treeNodeData[index+1].value
             hashString = self.calculate_hash(
                 treeNodeData[index].hash+treeNodeData[index+1].hash)
-            mergeNode = TreeNode(
-                value=mergeStrings,
+            mergeNode = self.new_node(
+                value=None,
                 hash=hashString,
                 leftNode=treeNodeData[index],
                 rightNode=treeNodeData[index+1],
+                leftLeaf=treeNodeData[index],
+                rightLeaf=treeNodeData[index+1],
                 depth=1,
                 childNum=2,
-                id=str(time.time()),
-                primeNum=str(
-                    int(treeNodeData[index].primeNum)*int(treeNodeData[index+1].primeNum)),
                 generation=self.history,
             )
+            self.merge_key(mergeNode)
             treeNodeData[index].father = mergeNode
             treeNodeData[index+1].father = mergeNode
             nodeQueue.append(mergeNode)
@@ -167,23 +444,21 @@ class MerkleTree:
         while len(nodeQueue) > 1:
             temp = []
             for index in range(0, len(nodeQueue), 2):
-                mergeStrings = nodeQueue[index].value + \
-                    ' '+nodeQueue[index+1].value
                 hashString = self.calculate_hash(
                     nodeQueue[index].hash+nodeQueue[index+1].hash)
-                mergeNode = TreeNode(
-                    value=mergeStrings,
+                mergeNode = self.new_node(
+                    value=None,
                     hash=hashString,
                     depth=nodeQueue[index].depth+1,
                     childNum=nodeQueue[index].childNum +
                     nodeQueue[index+1].childNum,
                     leftNode=nodeQueue[index],
                     rightNode=nodeQueue[index+1],
-                    id=str(time.time()),
-                    primeNum=str(
-                        int(nodeQueue[index].primeNum)*int(nodeQueue[index+1].primeNum)),
+                    leftLeaf=nodeQueue[index].leftLeaf,
+                    rightLeaf=nodeQueue[index+1].rightLeaf,
                     generation=self.history,
                 )
+                self.merge_key(mergeNode)
                 nodeQueue[index].father = mergeNode
                 nodeQueue[index+1].father = mergeNode
                 temp.append(mergeNode)
@@ -194,47 +469,26 @@ class MerkleTree:
 
     def build_merkle_tree(self, nodeData, way='filling', sorted=False):
         if len(nodeData) == 0:
-            print('INFO: 构建了个寂寞')
+            logger.warning('构建了个寂寞')
             return
+        start, hashCount = time.perf_counter(), self.hashCount
 
-        # 将每一个节点数据构造节点
-        if sorted == True:
-            nodeData = [int(i) for i in nodeData]
-            nodeData.sort()
-            nodeData = [str(i) for i in nodeData]
-
-        rootPrime = 1
+        self.sorted = sorted
+        self.way = way
+        self.leafIndex = {}
+        self.build_value_index()
         # 构造每一个叶子节点
-        treeNodeData = []
-        for data in nodeData:
-            while True:
-                newNodePrime = self.generate_prime_number()
-                if int(rootPrime) == 1:
-                    break
-                if int(rootPrime) % int(newNodePrime) == 0 and int(rootPrime) > int(newNodePrime):
-                    # print(newNodePrime, ' 重复！！')
-                    continue
-                else:
-                    break
-            rootPrime = str(int(rootPrime) * int(newNodePrime))
-            thisTime = str(time.time())
-            newNode = TreeNode(
-                value=data,
-                hash=self.calculate_hash(data+newNodePrime+thisTime),
-                depth=0,
-                childNum=0,
-                id=thisTime,
-                primeNum=newNodePrime,
-                generation=self.history,
-            )
-            treeNodeData.append(newNode)
-            print('INFO: 节点构造完成：', str(newNode))
+        treeNodeData = self.make_leaves(nodeData)
+        if logger.isEnabledFor(logging.DEBUG):  # 逐个节点的信息只在 DEBUG 级别输出
+            for newNode in treeNodeData:
+                logger.debug('节点构造完成：%s', newNode)
 
-        if way == 'filling':
+        if way == 'filling' and len(treeNodeData) > 1:
             self.root = self.bulid_complete_binary_tree(treeNodeData)
             self.newNodes = [self.root]
 
-        elif way == 'imbalance':
+        elif way in ('filling', 'imbalance'):
+            # 只有一个叶子时不需要补齐，两种方式相同
             # 计算能构造一颗完全二叉树的节点数量
             treeDepth = int(math.log2(len(treeNodeData)))  # 向下取整
 
@@ -255,216 +509,354 @@ class MerkleTree:
 
             self.root = self.bulid_complete_binary_tree(treeNodeDataSub_1)
             # 将剩余的不足2的整数幂的节点，依次插入
-            for node in treeNodeDataSub_2:
-                self.insert(node, addAgain=True)
+            self.insert_many(treeNodeDataSub_2)
 
-    def add(self, Data):
-        self.history += 1
-        rootPrime = self.root.primeNum
-        # 构造每一个叶子节点
-        treeNodeData = []
-        while True:
-            newNodePrime = self.generate_prime_number()
-            if int(rootPrime) == 1:
-                break
-            if int(rootPrime) % int(newNodePrime) == 0 and int(rootPrime) > int(newNodePrime):
-                # print(newNodePrime, ' 重复！！')
-                continue
-            else:
-                break
-        rootPrime = str(int(rootPrime) * int(newNodePrime))
-        thisTime = str(time.time())
-        newNode = TreeNode(
+        self.versions = {}
+        self.indexRoots = {}
+        self.removedLeaves = {}
+        self.removedOrder = deque()
+        self.save_version()
+        self.log_summary('构建完成', len(nodeData), start, hashCount)
+
+    def make_leaf(self, Data, rootPrime=1, register=True):
+        '''
+        函数功能：为数据 Data 构造一个叶子节点
+        叶子的 hash 值只由数据和叶子标号决定（按 leaf_data 编码，标号在树中唯一），与节点标号、创建顺序无关
+        register 为 False 时只构造节点，不登记到叶子字典中
+        '''
+        if self.sorted:
+            int(Data)  # 值索引按 int(value) 查找，不能转换为整数的数据在分配标号之前就报错
+        newNodePrime = self.generate_leaf_key(rootPrime)
+        newNode = self.new_node(
             value=Data,
-            hash=self.calculate_hash(Data+newNodePrime+thisTime),
+            hash=self.calculate_hash(leaf_data(Data, newNodePrime)),
             depth=0,
             childNum=0,
-            id=thisTime,
             primeNum=newNodePrime,
             generation=self.history,
         )
-        treeNodeData.append(newNode)
-        for node in treeNodeData:
-            self.insert(node)
+        if register:
+            self.register_leaf(newNode)
+        return newNode
+
+    def make_leaves(self, allData):
+        '''
+        函数功能：为一批数据构造叶子节点
+        所有叶子都构造成功（有序模式下还要写入值索引）之后才统一登记；任何一个数据出错时收回已分配的标号，树保持不变
+        '''
+        nextKey, nextId = self.nextKey, self.nextId
+        try:
+            treeNodeData = [self.make_leaf(Data, register=False) for Data in allData]
+            if self.sorted:
+                self.index_values([newNode.value for newNode in treeNodeData], 1)
+        except Exception:
+            self.nextKey, self.nextId = nextKey, nextId
+            raise
+        for newNode in treeNodeData:
+            self.register_leaf(newNode)
+        return treeNodeData
+
+    def add(self, Data):
+        start, hashCount = time.perf_counter(), self.hashCount
+        self.history += 1
+        # 构造叶子节点
+        try:
+            (newNode,) = self.make_leaves([Data])
+        except Exception:
+            self.history -= 1
+            raise
+        self.insert(newNode)
+        self.save_version()
+
+        logger.debug('节点构造完成：%s', newNode)
+        self.log_summary('添加完成', 1, start, hashCount)
+        return newNode.primeNum
+
+    def append(self, Data):
+        '''
+        函数功能：在树的最右边追加一个叶子，时间复杂度 O(log n)
+        返回值：新叶子的标号
+        '''
+        return self.add(Data)
+
+    def extend(self, allData):
+        '''
+        函数功能：批量追加叶子
+        所有叶子挂到树上之后再统一更新，每个受影响的祖先节点只计算一次 hash
+        返回值：新叶子的标号
+        '''
+        start, hashCount = time.perf_counter(), self.hashCount
+        self.history += 1
+        try:
+            # 先构造好所有叶子，全部成功之后才挂到树上
+            treeNodeData = self.make_leaves(allData)
+        except Exception:
+            self.history -= 1
+            raise
+        self.newNodes = []
+        self.insert_many(treeNodeData)
+        self.save_version()
+        self.log_summary('批量添加完成', len(treeNodeData), start, hashCount)
+        return [node.primeNum for node in treeNodeData]
+
+    def update(self, prime, Data):
+        '''
+        函数功能：修改标号为 prime 的叶子的数据，只需要重新计算一条路径上的 hash 值
+        '''
+        if not self.has_leaf(prime):
+            logger.warning('这棵树上没有这个叶子')
+            return
+
+        start, hashCount = time.perf_counter(), self.hashCount
+        # 先计算 hash 值、写入值索引（数据有误时在这里报错），再修改树
+        leaf = self.leafIndex[str(prime)]
+        leafHash = self.calculate_hash(leaf_data(Data, leaf.primeNum))
+        if self.sorted:
+            self.index_values([Data], 1)
+            self.index_values([leaf.value], -1)
+        self.history += 1
+        thisNode = self.own_path(leaf)
+        thisNode.value = Data
+        thisNode.hash = leafHash
+        thisNode.generation = self.history
+        self.newNodes = [thisNode]
+
+        # 自下而上更新沿路的节点
+        for thisNode in iter_root_path(thisNode.father):
+            self.merge_node(thisNode)
+            self.newNodes.append(thisNode)
+        self.save_version()
+        self.log_summary('修改完成', 1, start, hashCount)
+
+    def save_version(self):
+        '''
+        函数功能：persistent 模式下，记录这一代的树根
+        '''
+        if self.persistent:
+            self.versions[self.history] = self.root
+            if self.sorted:
+                self.indexRoots[self.history] = self.valueIndex.root_hash()
+
+    def own_path(self, node):
+        '''
+        函数功能：persistent 模式下，修改 node 之前先复制 node 和它不属于这一代的祖先（路径复制）
+        旧版本仍然引用原来的节点，不受影响；这一代新建的节点可以直接修改
+        返回值：当前版本中对应的节点
+        '''
+        if not self.persistent or node.generation == self.history:
+            return node
+
+        path = []
+        father = node
+        while father != None and father.generation != self.history:
+            path.append(father)
+            father = father.father
+
+        # 自上而下复制，把父亲（已经属于这一代）的孩子指针换成副本
+        for oldNode in reversed(path):
+            newNode = copy.copy(oldNode)
+            newNode.generation = self.history
+            if father == None:
+                self.root = newNode
+            elif father.leftNode == oldNode:
+                father.leftNode = newNode
+            else:
+                father.rightNode = newNode
+            if newNode.leftNode:
+                newNode.leftNode.father = newNode
+            if newNode.rightNode:
+                newNode.rightNode.father = newNode
+            if newNode.depth == 0 and self.leafIndex.get(str(newNode.primeNum)) == oldNode:
+                self.leafIndex[str(newNode.primeNum)] = newNode
+            self.newNodes.append(newNode)
+            father = newNode
+        return father
+
+    def prune(self, before=None):
+        '''
+        函数功能：丢弃第 before 代之前的版本（默认只保留当前版本），只被这些版本引用的节点随之回收
+        返回值：丢弃的版本数量
+        '''
+        if before == None:
+            before = self.history
+        old = [generation for generation in self.versions if generation < before]
+        for generation in old:
+            del self.versions[generation]
+            self.indexRoots.pop(generation, None)
+        # 第 before 代之后的删除、搬动记录才可能用到
+        self.pruned = max(self.pruned, before)
+        while self.removedOrder and self.removedOrder[0][0] <= before:
+            _, key = self.removedOrder.popleft()
+            del self.removedLeaves[key]
+        return len(old)
+
+    def last_leaf(self):
+        '''
+        函数功能：树上最右边的叶子，沿着右孩子（没有时为左孩子）向下走，时间复杂度 O(log n)
+        '''
+        thisNode = self.root
+        while thisNode.depth > 0:
+            thisNode = thisNode.rightNode or thisNode.leftNode
+        return thisNode
+
+    def move_leaf(self, source, target):
+        '''
+        函数功能：把叶子 source 的内容（数据、hash 值、标号等）搬到叶子 target 上
+        '''
+        for name in LEAF_FIELDS:
+            setattr(target, name, getattr(source, name))
+        self.leafIndex[str(target.primeNum)] = target
 
-        print('INFO: 节点构造完成：', str(newNode))
+    def build_value_index(self):
+        '''
+        函数功能：有序模式下，由所有叶子重新建立值索引（构建之前、解码之后调用）
+        '''
+        self.valueIndex = None
+        if self.sorted:
+            self.valueIndex = SparseMerkleTree(self.hashName, VALUE_INDEX_DEPTH)
+            self.index_values([leaf.value for leaf in self.leafIndex.values()], 1)
+
+    def index_values(self, allValue, delta):
+        '''
+        函数功能：把值索引中这些值的叶子数量各加上 delta（数量为 0 时从索引中删除），每个值 O(VALUE_INDEX_DEPTH)
+        中途出错时（数据不是整数，或者值索引的位置冲突）撤销已经做过的修改
+        '''
+        done = []
+        try:
+            for value in allValue:
+                key = str(int(value))
+                count = int(self.valueIndex.get(key) or 0) + delta
+                self.valueIndex.update(key, str(count) if count > 0 else None)
+                done.append(key)
+        except Exception:
+            for key in reversed(done):
+                count = int(self.valueIndex.get(key) or 0) - delta
+                self.valueIndex.update(key, str(count) if count > 0 else None)
+            raise
+
+    def index_hash(self, version=None):
+        '''
+        函数功能：值索引（或第 version 代值索引）树根的 hash 值，格式与节点的 hash 值相同；不是有序树时返回 None
+        '''
+        if not self.sorted:
+            return None
+        digest = self.valueIndex.root_hash() if version == None else self.indexRoots[version]
+        return digest if self.raw else digest.hex()
 
     def insert(self, node, addAgain=False):
         if addAgain == False:
             self.newNodes = []
-        self.newNodes.append(node)
-        canNodes = []
-        searchQueue = []
-        thisNode = self.root
-        if 2**(thisNode.depth) != thisNode.childNum:
-            # 说明这个节点是不够的
-            searchQueue.append(self.root)
-            while len(searchQueue) != 0:
-                thisNode = searchQueue[0]
-                searchQueue.pop(0)
-                # print(str(thisNode))
-                if thisNode.leftNode == None or thisNode.rightNode == None and thisNode.depth != 0:
-                    # print('check', str(thisNode))
-                    canNodes.append(thisNode)
-
-                if thisNode.rightNode and thisNode.rightNode.depth != 0 and 2**thisNode.rightNode.depth != thisNode.rightNode.childNum:
-                    searchQueue.append(thisNode.rightNode)
-                if thisNode.leftNode and thisNode.leftNode.depth != 0 and 2**thisNode.leftNode.depth != thisNode.leftNode.childNum:
-                    searchQueue.append(thisNode.leftNode)
-
-                # print('满足条件的孩子',[i.depth for i in searchQueue])
-            thisNode = canNodes[len(canNodes)-1]
-        # print('##################')
-        # print(str(thisNode))
-        # print('##################')
-        if thisNode == self.root:
-            #######################################
-            # 原先的树已经满了，需要构建新的根，和右分支 #
-            # 分两种情况：                          #
-            # 一、原先的树不是“满”，而是完全没有       #
-            # 二、第一步完成之后完全缺失右子树         #
-            # 二、满树                             #
-            #######################################
-
-            if thisNode.value == 'root':
-                # 第一种情况 原先的树不是“满”，而是完全没有
-                # 构造新树根
-                newRoot = TreeNode(
-                    value=node.value,
-                    hash=self.calculate_hash(node.hash),
-                    depth=node.depth+1,
-                    childNum=node.childNum+1,
-                    leftNode=node,
-                    rightNode=None,
-                    id=str(time.time()),
-                    primeNum=str(int(node.primeNum)),
-                    generation=self.history,
-                )
-                node.father = newRoot
-                self.root = newRoot  # 移植成功
-                # 记录新加入的节点
-                self.newNodes.append(newRoot)
-                return
-
-            elif thisNode.depth == 1 and thisNode.rightNode == None:
-                # 第二种情况 第一步完成之后完全缺失右子树
-                thisNode.value = thisNode.value+' '+node.value
-                thisNode.hash = self.calculate_hash(
-                    thisNode.leftNode.hash+node.hash)
-                thisNode.childNum += 1
-                thisNode.primeNum = str(
-                    int(thisNode.primeNum)*int(node.primeNum))
-
-                thisNode.rightNode = node
-                node.father = thisNode
-                return
-
-            # 第三  种情况 满树
-            nowTreeDepth = thisNode.depth
-            newright = node
-            for _ in range(nowTreeDepth):
-                newright_temp = TreeNode(
-                    value=node.value,
-                    hash=self.calculate_hash(newright.hash),
-                    depth=newright.depth+1,
-                    leftNode=newright,
-                    childNum=1,
-                    id=str(time.time()),
-                    primeNum=newright.primeNum,
-                    generation=self.history,
-                )
-                self.newNodes.append(newright_temp)
-                newright.father = newright_temp
-                newright = newright_temp
-            # 循环结束 构建右分支完成，并进行添加
+        self.insert_many([node])
 
+    def insert_many(self, treeNodeData):
+        '''
+        函数功能：把若干个叶子依次挂到树上，再自下而上统一更新沿路的节点
+        '''
+        dirtyNodes = {}
+        for node in treeNodeData:
+            self.newNodes.append(node)
+            for thisNode in self.attach(node):
+                dirtyNodes[id(thisNode)] = thisNode
+
+        ######################################
+        # 统一更新每个节点的数据                 #
+        ######################################
+        # 孩子的高度总是比父亲小，按高度从小到大更新即可
+        for thisNode in sorted(dirtyNodes.values(), key=lambda n: n.depth):
+            self.merge_node(thisNode)
+
+    def is_full(self, node):
+        '''
+        函数功能：判断以 node 为根的子树是否已经是满二叉树（叶子总是满的）
+        '''
+        return node.depth == 0 or 2**node.depth == node.childNum
+
+    def build_branch(self, node, depth):
+        '''
+        函数功能：在叶子 node 上面构建一条长度为 depth 的单孩子分支（左延伸）
+        返回值：分支上新建的节点（自下而上），hash 值稍后统一计算
+        '''
+        branch = []
+        newright = node
+        for _ in range(depth):
+            newright_temp = self.new_node(
+                value=None,
+                depth=newright.depth+1,
+                leftNode=newright,
+                childNum=1,
+                generation=self.history,
+            )
+            self.newNodes.append(newright_temp)
+            newright.father = newright_temp
+            newright = newright_temp
+            branch.append(newright)
+        return branch
+
+    def attach(self, node):
+        '''
+        函数功能：把叶子 node 挂到树的插入位置上，只沿一条路径向下查找，时间复杂度 O(log n)
+        返回值：需要重新计算 hash 值的节点
+        '''
+        thisNode = self.root
+        if thisNode.value == 'root':
+            # 第一种情况 原先的树不是“满”，而是完全没有
             # 构造新树根
-            newRoot = TreeNode(
-                value=thisNode.value+' '+newright.value,
-                hash=self.calculate_hash(thisNode.hash+newright.hash),
+            newRoot = self.new_node(
+                value=None,
+                depth=node.depth+1,
+                childNum=1,
+                leftNode=node,
+                generation=self.history,
+            )
+            node.father = newRoot
+            self.root = newRoot  # 移植成功
+            # 记录新加入的节点
+            self.newNodes.append(newRoot)
+            return [newRoot]
+
+        if self.is_full(thisNode):
+            # 第二种情况 满树，需要构建新的根和右分支
+            branch = self.build_branch(node, thisNode.depth)
+            newRoot = self.new_node(
+                value=None,
                 depth=thisNode.depth+1,
-                childNum=thisNode.childNum+newright.childNum,
+                childNum=thisNode.childNum+1,
                 leftNode=thisNode,
-                rightNode=newright,
-                id=str(time.time()),
-                primeNum=str(int(thisNode.primeNum)*int(newright.primeNum)),
+                rightNode=branch[-1] if branch else node,
                 generation=self.history,
             )
             self.newNodes.append(newRoot)
             thisNode.father = newRoot
-            newright.father = newRoot
+            newRoot.rightNode.father = newRoot
             self.root = newRoot  # 移植成功
+            return branch + [newRoot]
 
-        else:
-            #######################################
-            # 在右分支上进行添加节点，补充整棵树        #
-            # 分两种情况：                          #
-            # 1. 在左叶子节点的旁边直接添加右叶子节点   #
-            # 2. 添加右边的分支，然后作为其左叶子节点添加#
-            #######################################
-
-            # 第一种情况 直接添加
-            if thisNode != None and thisNode.depth == 1:
-                if thisNode.leftNode == None:
-                    thisNode.leftNode = node
-                else:
-                    thisNode.rightNode = node
-                node.father = thisNode
-
-            # 第二种情况 先构建右分支（左延伸）
-            if thisNode != None and thisNode.depth != 1:
-
-                if thisNode.rightNode == None:
-                    nowTreeDepth = thisNode.leftNode.depth
-                else:
-                    nowTreeDepth = thisNode.rightNode.depth
-
-                newright = node
-                for _ in range(nowTreeDepth):
-                    newright_temp = TreeNode(
-                        value=node.value,
-                        hash=self.calculate_hash(newright.hash),
-                        depth=newright.depth+1,
-                        leftNode=newright,
-                        childNum=1,
-                        id=str(time.time()),
-                        primeNum=newright.primeNum,
-                        generation=self.history,
-                    )
-                    self.newNodes.append(newright_temp)
-                    newright.father = newright_temp
-                    newright = newright_temp
-                # 循环结束 构建右分支完成，并进行添加
-
-                if thisNode.rightNode == None:
-                    thisNode.rightNode = newright
-                else:
-                    thisNode.leftNode = newright
-
-                newright.father = thisNode
-
-            ######################################
-            # 统一更新每个节点的数据                 #
-            ######################################
-            # 自下而上更新添加新节点之后，沿路的节点信息
-            while thisNode != None:
-                MergeString = ''
-                MergeHash = ''
-                MergePrime = 1
-                if thisNode.leftNode != None:
-                    MergeString = thisNode.leftNode.value
-                    MergeHash = thisNode.leftNode.hash
-                    MergePrime = int(thisNode.leftNode.primeNum)
-                if thisNode.rightNode != None:
-                    MergeString = MergeString + ' ' + thisNode.rightNode.value
-                    MergeHash = MergeHash + thisNode.rightNode.hash
-                    MergePrime = MergePrime * int(thisNode.rightNode.primeNum)
-
-                thisNode.value = MergeString
-                thisNode.hash = self.calculate_hash(MergeHash)
-                thisNode.childNum += 1
-                thisNode.primeNum = str(MergePrime)
-                thisNode = thisNode.father
+        # 第三种情况 沿着不满的孩子向下走，找到第一个空位
+        while True:
+            if thisNode.leftNode == None:
+                side = 'leftNode'
+                break
+            if not self.is_full(thisNode.leftNode):
+                thisNode = thisNode.leftNode
+                continue
+            if thisNode.rightNode == None:
+                side = 'rightNode'
+                break
+            thisNode = thisNode.rightNode
+
+        # 先构建右分支（左延伸），然后挂到空位上
+        thisNode = self.own_path(thisNode)
+        branch = self.build_branch(node, thisNode.depth - 1)
+        newright = branch[-1] if branch else node
+        setattr(thisNode, side, newright)
+        newright.father = thisNode
+
+        # 自下而上，沿路的节点多了一个叶子
+        dirtyNodes = branch
+        for thisNode in iter_root_path(thisNode):
+            thisNode.childNum += 1
+            dirtyNodes.append(thisNode)
+        return dirtyNodes
 
     def merkle_path(self, proofPath):
         '''
@@ -472,21 +864,14 @@ class MerkleTree:
         参数：proofPath 已经构建好的证明路径
         '''
         if proofPath == None:
-            print('INFO: 请检查验证路径的合理性')
+            logger.warning('请检查验证路径的合理性')
             return
-        queue = [proofPath]
-        thisNode = None
-        while len(queue) != 0:
-            thisNode = queue[0]
-            queue.pop(0)
-            if thisNode.leftNode:
-                queue.append(thisNode.leftNode)
-            if thisNode.rightNode:
-                queue.append(thisNode.rightNode)
+        # 层次遍历的最后一个节点在最深的一层，从它的父亲开始向上重新计算 hash 值
+        for thisNode in iter_level_order(proofPath):
+            pass
 
-        thisNode = thisNode.father
-        while thisNode != None:
-            mergeHash = ''
+        for thisNode in iter_root_path(thisNode.father):
+            mergeHash = self.emptyHash
             if thisNode.leftNode:
                 mergeHash = thisNode.leftNode.hash
             if thisNode.rightNode:
@@ -500,7 +885,6 @@ class MerkleTree:
                 thisNode.hashIsRight = False
 
             thisNode.hash = mergeHash
-            thisNode = thisNode.father
 
         dot = self.show(proofPath, proof=True)
         if proofPath.hashIsRight:
@@ -509,188 +893,289 @@ class MerkleTree:
             dot.attr(label=r'\nMerkle tree has been modified')
         return dot
 
+    def copy_node(self, node):
+        '''
+        函数功能：复制一个节点本身（不复制孩子和父亲），用于生成证明路径
+        '''
+        newNode = copy.copy(node)
+        newNode.leftNode = None
+        newNode.rightNode = None
+        newNode.father = None
+        return newNode
+
     def search(self, prime, showNode=False):
         # 保证数据类型正确
         prime = int(prime)
 
-        # 复制这棵树
-        proofNode = copy.deepcopy(self.root)
-        proofPath = proofNode
+        if not self.has_leaf(prime):
+            logger.warning('这棵树上没有这个叶子')
+            return None, None
+
+        # 只复制树根到叶子路径上的节点，以及它们的兄弟节点
+        path = self.locate_path(prime)
+        proofPath = self.copy_node(path[0])
+        proofNode = proofPath
+        for thisNode, nextNode in zip(path, path[1:]):
+            proofNode.value = '✱'
+            nextCopy = self.copy_node(nextNode)
+            nextCopy.father = proofNode
+
+            if nextNode == thisNode.leftNode:
+                proofNode.leftNode = nextCopy
+                if thisNode.rightNode:
+                    proofNode.rightNode = self.copy_node(thisNode.rightNode)
+                    proofNode.rightNode.value = 'Ref Hash'
+                    proofNode.rightNode.father = proofNode
+            else:
+                proofNode.rightNode = nextCopy
+                if thisNode.leftNode:
+                    proofNode.leftNode = self.copy_node(thisNode.leftNode)
+                    proofNode.leftNode.value = 'Ref Hash'
+                    proofNode.leftNode.father = proofNode
+            proofNode = nextCopy
 
-        thisNode = self.root
-        if int(thisNode.primeNum) % prime == 0:
-
-            # 如果是 叶子节点 就退出循环
-            while thisNode.leftNode or thisNode.rightNode:
-
-                if thisNode.leftNode and int(thisNode.leftNode.primeNum) % int(prime) == 0:
-                    thisNode = thisNode.leftNode
-
-                    if proofNode.rightNode:
-                        proofNode.rightNode.leftNode = None
-                        proofNode.rightNode.rightNode = None
-                        proofNode.rightNode.value = 'Ref Hash'
-                    proofNode.value = '✱'
-                    proofNode = proofNode.leftNode
-
-                elif thisNode.rightNode and int(thisNode.rightNode.primeNum) % int(prime) == 0:
-                    thisNode = thisNode.rightNode
-
-                    if proofNode.leftNode:
-                        proofNode.leftNode.leftNode = None
-                        proofNode.leftNode.rightNode = None
-                        proofNode.leftNode.value = 'Ref Hash'
-                    proofNode.value = '✱'
-                    proofNode = proofNode.rightNode
-                else:
-                    break
-            proofNode.value = 'Target'
-            proofPath.value = 'Root'
+        proofNode.value = 'Target'
+        proofPath.value = 'Root'
+        return path[-1], proofPath
 
+    def find_path(self, root, key, generation):
+        '''
+        函数功能：第 generation 代的树（树根为 root）中从树根到标号为 key 的叶子的路径，不依赖父亲指针
+        叶子都在同一深度、从左到右紧密排列，先算出 key 在那一代的位置，再按位置的二进制位自上而下走，
+        最后核对叶子的标号，时间复杂度 O(log n)
+        '''
+        position = self.position_at(key, generation)
+        if position == None or root.childNum == 0 or position >> root.depth:
+            return None
+        path = [root]
+        thisNode = root
+        for level in range(root.depth - 1, -1, -1):
+            thisNode = thisNode.rightNode if position >> level & 1 else thisNode.leftNode
+            if thisNode == None:
+                return None
+            path.append(thisNode)
+        if str(thisNode.primeNum) != str(key):
+            return None
+        return path
+
+    def get_proof(self, prime, version=None):
+        '''
+        函数功能：生成标号为 prime 的叶子的存在性证明（MerkleProof），时间复杂度 O(log n)
+        version 为历史版本的代数（persistent=True），证明针对那一代的树根
+        '''
+        if version != None:
+            if version not in self.versions:
+                logger.warning('没有这个版本')
+                return None
+            path = self.find_path(self.versions[version], prime, version)
+            if path == None:
+                logger.warning('这个版本上没有这个叶子')
+                return None
+        elif not self.has_leaf(prime):
+            logger.warning('这棵树上没有这个叶子')
+            return None
         else:
-            thisNode = None
-            proofPath = None
-            print('INFO: 这棵树上没有这个叶子')
+            path = self.locate_path(prime)
+        return self.path_proof(path, self.index_hash(version))
+
+    def path_proof(self, path, indexHash=None):
+        '''
+        函数功能：由树根到叶子的路径生成存在性证明（MerkleProof），只读取路径上的节点和它们的兄弟
+        indexHash 为有序树值索引的树根，作为最后一步的右兄弟（树根为 H(叶子树的树根 || indexHash)）
+        '''
+        proofPath = []
+        for thisNode, nextNode in zip(path, path[1:]):
+            if nextNode == thisNode.leftNode:
+                sibling = thisNode.rightNode
+                proofPath.append((sibling.hash if sibling else None, False))
+            else:
+                sibling = thisNode.leftNode
+                proofPath.append((sibling.hash if sibling else None, True))
+        proofPath.reverse()
+        if indexHash != None:
+            proofPath.append((indexHash, False))
+        return MerkleProof(path[-1].hash, proofPath, path[0].childNum, self.hashName, self.raw)
+
+    def prove_absent(self, value):
+        '''
+        函数功能：生成 value《不在》有序树上的证明（AbsenceProof），时间复杂度 O(VALUE_INDEX_DEPTH)
+        证明由值索引中 str(int(value)) 的不存在性证明和叶子树的树根组成，与叶子的数量、位置无关
+        '''
+        if not self.sorted:
+            logger.warning('只有有序树（sorted=True）才能证明元素不在树上')
+            return None
+        if self.root.childNum == 0:
+            logger.warning('空树没有树根，无法给出证明')
+            return None
+
+        key = str(int(value))
+        if self.valueIndex.get(key) != None:
+            logger.warning('这个元素在树上')
+            return None
+        return AbsenceProof(value, self.valueIndex.get_proof(key), self.root.hash, self.root.childNum,
+                            self.hashName, self.raw)
 
-        return thisNode, proofPath
+    def get_multiproof(self, primes):
+        '''
+        函数功能：为多个叶子生成一个共同的证明（MerkleMultiProof），共同的兄弟节点只出现一次
+        '''
+        nodes = {}
+        depth = 0
+        for prime in primes:
+            if not self.has_leaf(prime):
+                logger.warning('这棵树上没有这个叶子：%s', prime)
+                return None
+
+            # 自上而下记录路径上每个节点的位置
+            path = self.locate_path(prime)
+            depth = len(path) - 1
+            position = 0
+            nodes[(depth, 0)] = path[0]
+            for level, (thisNode, nextNode) in enumerate(zip(path, path[1:])):
+                position = 2 * position + (0 if nextNode == thisNode.leftNode else 1)
+                nodes[(depth - level - 1, position)] = nextNode
+
+        indexHash = self.index_hash()
+        if indexHash != None:
+            # 有序树的树根上面还有一层：右兄弟为值索引的树根
+            depth += 1
+
+        def hashOf(level, position):
+            if indexHash != None and (level, position) == (depth - 1, 1):
+                return indexHash
+            if (level, position) in nodes:
+                return nodes[(level, position)].hash
+            # 不在路径上的节点，是路径上某个节点的兄弟
+            father = nodes[(level + 1, position // 2)]
+            sibling = father.rightNode if position & 1 else father.leftNode
+            return sibling.hash if sibling else None
+
+        return build_multiproof(set(nodes), hashOf, depth, self.root.childNum, self.hashName, self.raw)
+
+    def root_hash(self, version=None):
+        '''
+        函数功能：树根（或第 version 代树根）的 hash 值，空树返回 None
+        有序树为 H(叶子树的树根 || 值索引的树根)
+        '''
+        root = self.root if version == None else self.versions[version]
+        if root.childNum == 0:
+            return None
+        if self.sorted:
+            return self.calculate_hash(root.hash + self.index_hash(version))
+        return root.hash
 
     def tampering_test(self, proofPath, Index):
         if proofPath == None:
-            print('INFO: 请检查验证路径的合理性')
+            logger.warning('请检查验证路径的合理性')
             return
 
         proofPath = copy.deepcopy(proofPath)
-        queue = [proofPath]
         count = 0
-        thisNode = None
-        while len(queue) != 0:
-            thisNode = queue[0]
-            queue.pop(0)
+        for thisNode in iter_level_order(proofPath):
             if not(thisNode.leftNode or thisNode.rightNode):
                 count += 1
             if count == Index:
                 thisNode.value = 'Modified'
-                thisNode.hash = 'chaos'
+                thisNode.hash = b'chaos' if self.raw else 'chaos'
                 break
-            if thisNode.leftNode:
-                queue.append(thisNode.leftNode)
-            if thisNode.rightNode:
-                queue.append(thisNode.rightNode)
         return proofPath
 
-    def getTreePrime(self,):
-        allPrime = []
-        queue = [self.root]
-        thisNode = None
-        while len(queue) != 0:
-            thisNode = queue[0]
-            queue.pop(0)
-            if thisNode.leftNode == None and thisNode.rightNode == None:
-                allPrime.append(thisNode.primeNum)
-            if thisNode.leftNode:
-                queue.append(thisNode.leftNode)
-            if thisNode.rightNode:
-                queue.append(thisNode.rightNode)
-        return allPrime
+    def getTreePrime(self, limit=None):
+        '''
+        函数功能：从左到右返回所有叶子的标号
+        参数：limit 只需要前 limit 个叶子时，遍历到之后立即停止
+        '''
+        if self.root.childNum == 0:
+            # 空树的树根不是叶子
+            return []
+        return [leaf.primeNum for leaf in islice(iter_leaves(self.root), limit)]
 
     def compare(self, showHistory=False):
-        dot = self.show()
+        '''
+        函数功能：展示整棵树，并为节点染色（最近一次修改的节点，或者按节点的代数）
+        颜色在绘制的那一次遍历中确定，不需要再遍历一次树
+        '''
         if showHistory == False:
-            for node in self.newNodes:
-                dot.node(node.id, _attributes={'fillcolor': '#FFCDD2'})
+            newIds = {node.id for node in self.newNodes}
+
+            def colors(node):
+                return '#FFCDD2' if node.id in newIds else None
         else:
             allColor = ['#FFCDD2', '#FFE0B2', '#FFF9C4',
                         '#C8E6C9', '#B2EBF2', '#BBDEFB', '#E1BEE7']
-            queue = [self.root]
-            thisNode = None
-            while len(queue) != 0:
-                thisNode = queue[0]
-                queue.pop(0)
-                dot.node(thisNode.id, _attributes={
-                    'fillcolor': allColor[abs(thisNode.generation-self.history) % len(allColor)]
-                }
-                )
-                if thisNode.leftNode:
-                    queue.append(thisNode.leftNode)
-                if thisNode.rightNode:
-                    queue.append(thisNode.rightNode)
-        return dot
+
+            def colors(node):
+                return allColor[abs(node.generation-self.history) % len(allColor)]
+        return self.show(colors=colors)
 
     def remove(self, prime):
         '''
-        函数功能：删除节点
+        函数功能：删除标号为 prime 的叶子
+        用最后一个叶子填补被删除的位置，只需要更新两条路径，时间复杂度 O(log n)；
+        有序模式下还要从值索引中删掉这个值，O(VALUE_INDEX_DEPTH)
         '''
-        # 不能整除，说明不在这棵树中
-        if int(self.root.primeNum) % int(prime) != 0:
-            print('INFO: 这棵树上没有这个叶子')
+        if not self.has_leaf(prime):
+            logger.warning('这棵树上没有这个叶子')
             return
 
-        # 层次遍历，查询满足条件的节点
-        queue = [self.root]
-        thisNode = None
-        while len(queue) != 0:
-            thisNode = queue[0]
-            queue.pop(0)
-            if thisNode.leftNode == None and thisNode.rightNode == None and thisNode.primeNum == str(prime):
-                # 找到了结束搜寻
-                break
-            if thisNode.leftNode:
-                queue.append(thisNode.leftNode)
-            if thisNode.rightNode:
-                queue.append(thisNode.rightNode)
+        start, hashCount = time.perf_counter(), self.hashCount
+        if self.sorted:
+            self.index_values([self.leafIndex[str(prime)].value], -1)
+        if self.persistent:
+            # 新的一代，newNodes 只记录这一次复制的节点
+            self.history += 1
+            self.newNodes = []
 
-        # 直接找到它的父亲，断绝父子关系
+        # 被删除的位置由最后一个叶子填补，然后摘掉最后一个位置，叶子始终靠左排列，不会留下空位
+        thisNode = self.own_path(self.leafIndex.pop(str(prime)))
+        moved = []
+        last = self.last_leaf()
+        if self.persistent:
+            # 记下叶子在这一代之前的位置，历史版本按位置查找叶子（find_path）
+            position = self.leaf_position(thisNode)
+            self.removedLeaves[str(prime)] = (self.history, position, thisNode.moves)
+            self.removedOrder.append((self.history, str(prime)))
+            lastPosition = self.leaf_position(last)
+        if last != thisNode:
+            self.move_leaf(last, thisNode)
+            if self.persistent:
+                moves = tuple(move for move in thisNode.moves if move[0] > self.pruned)
+                thisNode.moves = ((self.history, lastPosition),) + moves
+            moved.append(thisNode)
+            thisNode = self.own_path(last)
+
+        # 断绝父子关系，沿路的节点少了一个叶子，变空的中间节点一并摘掉
         hisFather = thisNode.father
         if hisFather.leftNode == thisNode:
             hisFather.leftNode = None
-        elif hisFather.rightNode == thisNode:
+        else:
             hisFather.rightNode = None
-
-        # 自下而上的矫正数据
-        while hisFather:
+        for hisFather in iter_root_path(hisFather):
+            hisFather.childNum -= 1
             if hisFather.leftNode and hisFather.leftNode.childNum <= 0 and hisFather.leftNode.depth != 0:
                 hisFather.leftNode = None
             if hisFather.rightNode and hisFather.rightNode.childNum <= 0 and hisFather.rightNode.depth != 0:
                 hisFather.rightNode = None
 
-            MergeString = ''
-            MergeHash = ''
-            MergePrime = 1
-
-            if hisFather.leftNode:
-                MergeString = hisFather.leftNode.value
-                MergeHash = hisFather.leftNode.hash
-                MergePrime = int(hisFather.leftNode.primeNum)
-            if hisFather.rightNode:
-                MergeString = MergeString + ' ' + hisFather.rightNode.value
-                MergeHash = MergeHash + hisFather.rightNode.hash
-                MergePrime = MergePrime * int(hisFather.rightNode.primeNum)
-
-            hisFather.childNum -= 1
-            hisFather.value = MergeString
-            hisFather.hash = self.calculate_hash(MergeHash)
-            hisFather.primeNum = str(MergePrime)
-            hisFather = hisFather.father
+        # 自下而上重新计算两条路径上的节点，直到树根
+        dirtyNodes = {}
+        for node in moved + [thisNode]:
+            for father in iter_root_path(node.father):
+                if father.childNum > 0:
+                    dirtyNodes[id(father)] = father
+        for father in sorted(dirtyNodes.values(), key=lambda n: n.depth):
+            self.merge_node(father)
 
         # 树根矫正
         # 解释：
         #   如果删除操作之后，就剩一个根了，那就回到初始化状态
         if self.root.childNum == 0:
-            self.root = TreeNode(
-                value='root',
-                hash='',
-                childNum=0,
-                depth=0,
-                id=str(time.time()),
-                generation=self.history,
-                primeNum=self.generate_prime_number()
-            )
+            self.root = self.empty_root()
 
         # 树根到叶子的路径矫正 (修正树根)
         # 解释：
-        #   如果树根 有且只有一个孩子 并且他的高度大于等于2
-        #   那么，我们需要让这个树根向下走，因为当前这个树根
-        #   是多余的，他的孩子可以代替他
+        #   叶子都在左半边时，树根只剩左孩子，它的孩子可以代替它，树高减一；
+        #   叶子始终靠左排列，所以只需要检查树根，其它层不会冗余
         while self.root.depth >= 2 and ((self.root.leftNode != None) ^ (self.root.rightNode != None)):
             if self.root.leftNode:
                 self.root = self.root.leftNode
@@ -698,63 +1183,8 @@ class MerkleTree:
                 self.root = self.root.rightNode
             self.root.father = None
 
-        # 删除树中冗余的层  (修正树根)
-        # 解释：
-        #   当删除到一定程度的时候，树中的第i层可能会和第j层
-        #   一样，这就需要我们进行处理 删除冗余的层保证树高
-        queue = [self.root]
-        thisNode = None
-        while len(queue) != 0:
-            A, B = [], []
-            nextLayer = []
-            for node_i in queue:
-                A.append(int(node_i.primeNum))
-
-                if node_i.leftNode and node_i.depth >= 2:
-                    nextLayer.append(node_i.leftNode)
-                if node_i.rightNode and node_i.depth >= 2:
-                    nextLayer.append(node_i.rightNode)
-
-            for node_i in nextLayer:
-                B.append(int(node_i.primeNum))
-
-            if A == B:
-                for i in range(len(queue)):
-                    tempFather = queue[i].father
-                    if tempFather and tempFather.leftNode == queue[i]:
-                        tempFather.leftNode = nextLayer[i]
-                    elif tempFather and tempFather.rightNode == queue[i]:
-                        tempFather.rightNode = nextLayer[i]
-                    nextLayer[i].father = tempFather
-
-                    # 更新数据
-                    MergeString = ''
-                    MergeHash = ''
-                    MergePrime = 1
-                    MergeChild = 0
-                    MergeDepth = 0
-                    if tempFather.leftNode:
-                        MergeString = tempFather.leftNode.value
-                        MergeHash = tempFather.leftNode.hash
-                        MergePrime = int(tempFather.leftNode.primeNum)
-                        MergeChild += tempFather.leftNode.childNum
-                        MergeDepth = tempFather.leftNode.depth + 1
-                    if tempFather.rightNode:
-                        MergeString = MergeString + ' ' + tempFather.rightNode.value
-                        MergeHash = MergeHash + tempFather.rightNode.hash
-                        MergePrime = MergePrime * \
-                            int(tempFather.rightNode.primeNum)
-                        MergeChild += tempFather.rightNode.childNum
-                        MergeDepth = tempFather.rightNode.depth + 1
-
-                    tempFather.childNum = MergeChild
-                    tempFather.value = MergeString
-                    tempFather.hash = self.calculate_hash(MergeHash)
-                    tempFather.primeNum = str(MergePrime)
-                    tempFather.depth = MergeDepth
-
-            queue = nextLayer
-
+        self.save_version()
+        self.log_summary('删除完成', 1, start, hashCount)
         return
 
     # def calculate_minimum_height(self, node):
@@ -776,121 +1206,127 @@ class MerkleTree:
     #     node.rm = maxLR
     #     return maxLR + addYN
 
-    def show(self, node=0, proof=False, showDepth=True, showMinDepth=False, string=None):
+    def show(self, node=0, proof=False, showDepth=True, showMinDepth=False, string=None, colors=None):
         # 默认值为展示整棵树
         if node == 0:
             node = self.root
+        return show_tree(node, proof=proof, showDepth=showDepth, showMinDepth=showMinDepth, string=string, colors=colors)
 
-        # 如果输入不合法，直接返回
-        if node == None:
-            return
-
-        # 构建可视化的对象
-        dot = Digraph(name='MerkleTree', format='png')
-
-        # 展示树的高度
-        if showDepth:
-            # 标注树的高度
-            for i in range(node.depth+1):
-                dot.node(
-                    name=str(i),
-                    label='depth : '+str(node.depth-i),
-                    _attributes={'color': '#FFFFFF'})
-
-            for i in range(node.depth):
-                dot.edge(str(i), str(i+1), _attributes={'arrowhead': 'none', 'color': '#FFFFFF'})
-
-        # 使用层次遍历
-        queue = [node]
-        countofProof = 0  # 标志用于作证hash的节点序号
 
-        while len(queue) != 0:
-            # temp 变量用于存储 某一层（depth=i）的所有节点信息
-            temp = []
+def show_tree(node, proof=False, showDepth=True, showMinDepth=False, string=None, colors=None):
+    '''
+    函数功能：将以 node 为根的（子）树绘制成 Graphviz 对象
+    说明：MerkleTree 与 FlatMerkleTree 共用这一段绘制逻辑
+    colors 为函数 colors(node)，返回节点的填充颜色（None 时使用默认颜色）
+    '''
+    # 如果输入不合法，直接返回
+    if node == None:
+        return
 
-            for node_i in queue:
-                # 现将节点所包含的树叶的个数加进去
-                nodeString = 'childs: ' + str(node_i.childNum)
-
-                # 如果节点的 value 太长，这样不利于显示，所以 “掐头去尾” 的显示
-                if len(node_i.value) > 8:
-                    strings = str(node_i.value).split(' ')
-                    strsL = len(strings)-1
-                    nodeString = strings[0] + ' ~ ' + \
-                        strings[strsL] + '\n' + nodeString
-                else:
-                    nodeString = node_i.value + '\n' + nodeString
-
-                # 可视化节点的默认颜色
-                node_color = '#FFFFFF'
-
-                # 如果是 “证明Merkle路径” 时候用到的，可以为该事务染上直观的颜色
-                if proof == True:
-                    if node_i.value == 'Ref Hash':
-                        # 用于佐证的节点 橙色
-                        node_color = '#FFA500'
-                        nodeString = node_i.value
-
-                    elif node_i.value == 'Target':
-                        # “请求者” 需要证明的节点 蓝色
-                        node_color = '#BBDEFB'
-                        nodeString = node_i.value
-
-                    elif node_i.value == 'Modified':
-                        # 被篡改的节点 灰色
-                        node_color = '#E0E0E0'
-                        nodeString = node_i.value
-
-                    elif node_i.value == '✱':
-                        # 如果为中间连接的节点
-                        # 如果节点的hash值计算的结果 不一致 红色
-                        if node_i.hashIsRight == False:
-                            node_color = '#FFCDD2'
-                            nodeString = '✕'
-                        else:
-                            # 否则 绿色
-                            node_color = '#C8E6C9'
-                            nodeString = '✓'
-
-                    elif node_i.value == 'Root':
-                        # 根节点
-                        if node_i.hashIsRight == False:
-                            node_color = '#FFCDD2'
-                            nodeString = 'Root ✕'
-                        else:
-                            # 否则 绿色
-                            node_color = '#C8E6C9'
-                            nodeString = 'Root ✓'
-
-                    # 叶子节点，为叶子节点标注序号
-                    if not(node_i.leftNode or node_i.rightNode):
-                        countofProof += 1
-                        nodeString = str(countofProof)+'\n'+nodeString
-
-                if showMinDepth == True:
-                    nodeString += '\n minD: '+str(node_i.rm)
-                # 可视化对象中添加节点
-                # 设置好上面设置好的相关属性
-                dot.node(
-                    name=node_i.id,
-                    label=nodeString,
-                    style='filled',
-                    fillcolor=node_color)
-
-                # 构建与左叶子节点的连接关系
-                if node_i.leftNode:
-                    temp.append(node_i.leftNode)
-                    dot.edge(node_i.id, node_i.leftNode.id)
-
-                # 构建与右叶子节点的连接关系
-                if node_i.rightNode:
-                    temp.append(node_i.rightNode)
-                    dot.edge(node_i.id, node_i.rightNode.id)
-
-            # 跳转到下一层
-            queue = temp
-
-            if string:
-                dot.attr(label=r'\n'+string)
-                
-        return dot
+    # 构建可视化的对象
+    dot = Digraph(name='MerkleTree', format='png')
+
+    # 展示树的高度
+    if showDepth:
+        # 标注树的高度
+        for i in range(node.depth+1):
+            dot.node(
+                name='depth'+str(i),
+                label='depth : '+str(node.depth-i),
+                _attributes={'color': '#FFFFFF'})
+
+        for i in range(node.depth):
+            dot.edge('depth'+str(i), 'depth'+str(i+1), _attributes={'arrowhead': 'none', 'color': '#FFFFFF'})
+
+    # 使用层次遍历
+    countofProof = 0  # 标志用于作证hash的节点序号
+
+    # queue 为某一层（depth=i）的所有节点
+    for queue in iter_levels(node):
+        for node_i in queue:
+            # 现将节点所包含的树叶的个数加进去
+            nodeString = 'childs: ' + str(node_i.childNum)
+
+            # 中间节点只保存叶子范围，展示时生成 “首 ~ 尾” 的标签
+            if node_i.value == None:
+                nodeString = node_i.label() + '\n' + nodeString
+
+            # 如果节点的 value 太长，这样不利于显示，所以 “掐头去尾” 的显示
+            elif len(node_i.value) > 8:
+                strings = str(node_i.value).split(' ')
+                strsL = len(strings)-1
+                nodeString = strings[0] + ' ~ ' + \
+                    strings[strsL] + '\n' + nodeString
+            else:
+                nodeString = node_i.value + '\n' + nodeString
+
+            # 可视化节点的默认颜色
+            node_color = '#FFFFFF'
+            if colors != None:
+                node_color = colors(node_i) or node_color
+
+            # 如果是 “证明Merkle路径” 时候用到的，可以为该事务染上直观的颜色
+            if proof == True:
+                if node_i.value == 'Ref Hash':
+                    # 用于佐证的节点 橙色
+                    node_color = '#FFA500'
+                    nodeString = node_i.value
+
+                elif node_i.value == 'Target':
+                    # “请求者” 需要证明的节点 蓝色
+                    node_color = '#BBDEFB'
+                    nodeString = node_i.value
+
+                elif node_i.value == 'Modified':
+                    # 被篡改的节点 灰色
+                    node_color = '#E0E0E0'
+                    nodeString = node_i.value
+
+                elif node_i.value == '✱':
+                    # 如果为中间连接的节点
+                    # 如果节点的hash值计算的结果 不一致 红色
+                    if node_i.hashIsRight == False:
+                        node_color = '#FFCDD2'
+                        nodeString = '✕'
+                    else:
+                        # 否则 绿色
+                        node_color = '#C8E6C9'
+                        nodeString = '✓'
+
+                elif node_i.value == 'Root':
+                    # 根节点
+                    if node_i.hashIsRight == False:
+                        node_color = '#FFCDD2'
+                        nodeString = 'Root ✕'
+                    else:
+                        # 否则 绿色
+                        node_color = '#C8E6C9'
+                        nodeString = 'Root ✓'
+
+                # 叶子节点，为叶子节点标注序号
+                if not(node_i.leftNode or node_i.rightNode):
+                    countofProof += 1
+                    nodeString = str(countofProof)+'\n'+nodeString
+
+            if showMinDepth == True:
+                nodeString += '\n minD: '+str(node_i.rm)
+            # 可视化对象中添加节点
+            # 设置好上面设置好的相关属性
+            dot.node(
+                name=str(node_i.id),
+                label=nodeString,
+                style='filled',
+                fillcolor=node_color)
+
+            # 构建与左叶子节点的连接关系
+            if node_i.leftNode:
+                dot.edge(str(node_i.id), str(node_i.leftNode.id))
+
+            # 构建与右叶子节点的连接关系
+            if node_i.rightNode:
+                dot.edge(str(node_i.id), str(node_i.rightNode.id))
+
+        if string:
+            dot.attr(label=r'\n'+string)
+            
+    return dot
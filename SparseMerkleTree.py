@@ -0,0 +1,206 @@
+from functools import lru_cache
+from MerkleHash import DIGEST_SIZE, get_hash_backend
+import logging
+
+'''
+稀疏 Merkle 树（键值状态）
+
+叶子的位置由键的 hash 值决定，树的形状固定（高度为 depth），不需要任何重新平衡。
+空子树的 hash 值提前算好（defaultHashes），只保存不等于默认值的节点，
+所以插入、修改、删除都只需要重新计算一条路径，时间复杂度 O(depth)。
+同一棵树既可以证明某个键《存在》，也可以证明某个键《不存在》（对应的叶子为空）。
+'''
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def default_hashes(hashName='sha256', depth=DIGEST_SIZE*8):
+    '''
+    函数功能：每一层空子树的 hash 值，第 0 层（空叶子）为全 0 的摘要
+    '''
+    hashFunc = get_hash_backend(hashName)
+    defaultHashes = [bytes(DIGEST_SIZE)]
+    for _ in range(depth):
+        defaultHashes.append(hashFunc(defaultHashes[-1] + defaultHashes[-1]))
+    return tuple(defaultHashes)
+
+
+def leaf_hash(hashFunc, keyHash, value):
+    '''
+    函数功能：非空叶子的 hash 值 H(H(key) || H(value))
+    '''
+    return hashFunc(keyHash + hashFunc(value.encode('utf-8')))
+
+
+def key_index(keyHash, depth):
+    '''
+    函数功能：键对应的叶子位置（取键的 hash 值的高 depth 位）
+    '''
+    return int.from_bytes(keyHash, 'big') >> (DIGEST_SIZE*8 - depth)
+
+
+class SparseMerkleProof:
+    '''
+    稀疏 Merkle 树的证明
+    key         键
+    value       键对应的值；为 None 时是《不存在》的证明
+    siblings    自下而上的兄弟节点 hash 值，等于默认值（空子树）的记为 None
+    depth       树的高度
+    '''
+
+    def __init__(self, key, value, siblings, depth, hashName='sha256'):
+        self.key = key
+        self.value = value
+        self.siblings = siblings
+        self.depth = depth
+        self.hashName = hashName
+
+    def __len__(self):
+        return sum(1 for sibling in self.siblings if sibling != None)
+
+    def __str__(self):
+        kind = 'inclusion' if self.value != None else 'exclusion'
+        return 'SparseMerkleProof(key='+str(self.key)+', '+kind+', siblings='+str(len(self))+')'
+
+
+def compute_sparse_root(proof):
+    '''
+    函数功能：由稀疏 Merkle 树的证明自下而上计算出树根的 hash 值，证明不完整时返回 None
+    '''
+    if len(proof.siblings) != proof.depth:
+        return None
+    hashFunc = get_hash_backend(proof.hashName)
+    defaultHashes = default_hashes(proof.hashName, proof.depth)
+    keyHash = hashFunc(str(proof.key).encode('utf-8'))
+    index = key_index(keyHash, proof.depth)
+
+    thisHash = defaultHashes[0]
+    if proof.value != None:
+        thisHash = leaf_hash(hashFunc, keyHash, proof.value)
+    for level, sibling in enumerate(proof.siblings):
+        if sibling == None:
+            sibling = defaultHashes[level]
+        if index & 1:
+            thisHash = hashFunc(sibling + thisHash)
+        else:
+            thisHash = hashFunc(thisHash + sibling)
+        index >>= 1
+    return thisHash
+
+
+def verify_sparse_proof(root, proof):
+    '''
+    函数功能：验证稀疏 Merkle 树的存在性 / 不存在性证明，不需要树本身
+    '''
+    if proof == None or root == None:
+        return False
+    return compute_sparse_root(proof) == root
+
+
+class SparseMerkleTree:
+    '''
+    稀疏 Merkle 树
+    hashName    hash 算法（sha256 / blake2b / blake3）
+    depth       树的高度，叶子位置取键的 hash 值的高 depth 位（默认 256 位，不会冲突）
+    nodes       {(层号, 位置): hash}，只保存不等于默认值的节点，叶子为第 0 层
+    leaves      {叶子位置: (键, 值)}
+    '''
+
+    def __init__(self, hashName='sha256', depth=DIGEST_SIZE*8):
+        if not 0 < depth <= DIGEST_SIZE*8:
+            raise ValueError('树的高度必须在 1 到 %d 之间' % (DIGEST_SIZE*8))
+        self.hashName = hashName
+        self.hashFunc = get_hash_backend(hashName)
+        self.depth = depth
+        self.defaultHashes = default_hashes(hashName, depth)
+        self.nodes = {}
+        self.leaves = {}
+
+    def __len__(self):
+        return len(self.leaves)
+
+    def __contains__(self, key):
+        return self.get(key) != None
+
+    def key_hash(self, key):
+        return self.hashFunc(str(key).encode('utf-8'))
+
+    def root_hash(self):
+        '''
+        函数功能：树根的 hash 值（空树为第 depth 层的默认值）
+        '''
+        return self.nodes.get((self.depth, 0), self.defaultHashes[self.depth])
+
+    def node_hash(self, level, index):
+        return self.nodes.get((level, index), self.defaultHashes[level])
+
+    def store(self, level, index, thisHash):
+        '''
+        函数功能：保存一个节点，等于默认值（空子树）的节点直接丢弃
+        '''
+        if thisHash == self.defaultHashes[level]:
+            self.nodes.pop((level, index), None)
+        else:
+            self.nodes[(level, index)] = thisHash
+
+    def update_path(self, index, thisHash):
+        '''
+        函数功能：从第 index 个叶子开始，自下而上重新计算一条路径，时间复杂度 O(depth)
+        '''
+        hashFunc = self.hashFunc
+        for level in range(self.depth):
+            self.store(level, index, thisHash)
+            sibling = self.node_hash(level, index ^ 1)
+            if index & 1:
+                thisHash = hashFunc(sibling + thisHash)
+            else:
+                thisHash = hashFunc(thisHash + sibling)
+            index >>= 1
+        self.store(self.depth, 0, thisHash)
+
+    def get(self, key):
+        '''
+        函数功能：查询键对应的值，不存在时返回 None
+        '''
+        keyHash = self.key_hash(key)
+        leaf = self.leaves.get(key_index(keyHash, self.depth))
+        if leaf == None or leaf[0] != key:
+            return None
+        return leaf[1]
+
+    def update(self, key, value):
+        '''
+        函数功能：插入或修改一个键值对，value 为 None 时删除
+        '''
+        if value == None:
+            return self.delete(key)
+
+        keyHash = self.key_hash(key)
+        index = key_index(keyHash, self.depth)
+        if index in self.leaves and self.leaves[index][0] != key:
+            raise ValueError('叶子位置冲突：%s 与 %s（请增大树的高度）' % (key, self.leaves[index][0]))
+        self.leaves[index] = (key, value)
+        self.update_path(index, leaf_hash(self.hashFunc, keyHash, value))
+
+    def delete(self, key):
+        '''
+        函数功能：删除一个键，叶子恢复为空，树的形状不变
+        '''
+        index = key_index(self.key_hash(key), self.depth)
+        leaf = self.leaves.get(index)
+        if leaf == None or leaf[0] != key:
+            logger.warning('这棵树上没有这个键')
+            return
+        del self.leaves[index]
+        self.update_path(index, self.defaultHashes[0])
+
+    def get_proof(self, key):
+        '''
+        函数功能：生成键 key 的证明，键存在时为存在性证明，否则为不存在性证明
+        '''
+        index = key_index(self.key_hash(key), self.depth)
+        siblings = []
+        for level in range(self.depth):
+            siblings.append(self.nodes.get((level, (index >> level) ^ 1)))
+        return SparseMerkleProof(key, self.get(key), siblings, self.depth, self.hashName)
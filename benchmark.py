@@ -0,0 +1,208 @@
+from FlatMerkleTree import FlatMerkleTree
+from MerkleProof import verify_proof, verify_proofs
+from MerkleService import MerkleService
+from MerkleSnapshot import SnapshotMerkleTree
+from MerkleTree import MerkleTree
+import asyncio
+import contextlib
+import logging
+import os
+import random
+import threading
+import time
+
+'''
+性能测试脚本
+
+运行：python benchmark.py
+'''
+
+
+@contextlib.contextmanager
+def quiet():
+    '''
+    函数功能：屏蔽计时过程中的日志输出，避免 I/O 影响计时
+    '''
+    logging.disable(logging.WARNING)
+    try:
+        yield
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+def bench_index_update(sizes=(16, 1024, 8192, 65536), rounds=20):
+    '''
+    函数功能：比较 'prime' 与 'hash' 两种成员索引下，单次 add / remove 的平均耗时
+    说明：两种模式都只更新一条路径，但 'prime' 模式路径上的素数之积随叶子数量变长，
+         叶子很多时大整数乘法的代价会超过 hash 计算
+    '''
+    print('%-8s %-8s %12s %12s' % ('index', 'leaves', 'add(us)', 'remove(us)'))
+    for index in ('prime', 'hash'):
+        for size in sizes:
+            with quiet():
+                mt = MerkleTree(index=index)
+                mt.build_merkle_tree([str(i) for i in range(size)], way='imbalance')
+
+                start = time.perf_counter()
+                for i in range(rounds):
+                    mt.add(str(size + i))
+                addTime = (time.perf_counter() - start) / rounds
+
+                keys = mt.getTreePrime()[-rounds:]
+                start = time.perf_counter()
+                for key in keys:
+                    mt.remove(key)
+                removeTime = (time.perf_counter() - start) / rounds
+            print('%-8s %-8d %12.1f %12.1f' % (index, size, addTime * 1e6, removeTime * 1e6))
+
+
+def bench_flat_build(sizes=(2**16, 2**18, 2**20)):
+    '''
+    函数功能：比较 FlatMerkleTree 逐个节点计算与整层批量计算的构建耗时
+    '''
+    print('%-10s %12s %12s' % ('leaves', 'loop(s)', 'batched(s)'))
+    for size in sizes:
+        nodeData = [str(i) for i in range(size)]
+        cost = []
+        for batched in (False, True):
+            tree = FlatMerkleTree(batched=batched)
+            start = time.perf_counter()
+            tree.build_merkle_tree(nodeData, way='imbalance')
+            cost.append(time.perf_counter() - start)
+        print('%-10d %12.3f %12.3f' % (size, cost[0], cost[1]))
+
+
+def bench_parallel_build(size=2**21, allWorkers=(1, 2, 4, 8)):
+    '''
+    函数功能：多进程构建 FlatMerkleTree 的加速比（树根与单进程构建一致）
+    workers 超过 CPU 核数时只能测到多进程的额外开销，这些行标记为 *
+    '''
+    nodeData = [str(i) for i in range(size)]
+    cores = os.cpu_count()
+    print('cpu cores: %s' % cores)
+    print('%-8s %10s %10s' % ('workers', 'time(s)', 'speedup'))
+    base = None
+    rootHash = None
+    for workers in allWorkers:
+        tree = FlatMerkleTree()
+        start = time.perf_counter()
+        tree.build_merkle_tree(nodeData, way='imbalance', workers=workers)
+        cost = time.perf_counter() - start
+        if base == None:
+            base, rootHash = cost, tree.root_hash()
+        assert tree.root_hash() == rootHash
+        print('%-8d %10.3f %10.2f%s' % (workers, cost, base / cost, ' *' if workers > (cores or 1) else ''))
+
+
+def bench_verify(size=2**16, proofs=2**17, allWorkers=(None, 4), useProcess=(False, True)):
+    '''
+    函数功能：批量验证证明的吞吐量（逐个验证、线程池、进程池）
+    '''
+    tree = FlatMerkleTree()
+    tree.build_merkle_tree([str(i) for i in range(size)], way='imbalance')
+    rootHash = tree.root_hash()
+    allProof = [tree.get_proof(i % size) for i in range(proofs)]
+    pairs = [(rootHash, proof) for proof in allProof]
+
+    print('%-8s %-8s %14s' % ('workers', 'process', 'proofs/s'))
+    for workers in allWorkers:
+        for process in useProcess if workers else (False,):
+            stats = {}
+            assert all(verify_proofs(pairs, workers=workers, useProcess=process, stats=stats))
+            print('%-8s %-8s %14.0f' % (workers or 1, process, stats['proofsPerSecond']))
+
+
+def bench_snapshot_readers(size=4096, allReaders=(1, 2, 4, 8), duration=1.0):
+    '''
+    函数功能：一个写线程不停地 add / remove，多个读线程在快照上生成并验证证明
+    每个证明都针对读线程取得的同一个快照验证，不应该出现失败
+    '''
+    print('%-8s %12s %12s %10s' % ('readers', 'proofs/s', 'writes/s', 'failed'))
+    for readers in allReaders:
+        with quiet():
+            tree = SnapshotMerkleTree()
+            tree.build_merkle_tree([str(i) for i in range(size)])
+        keys = list(tree.tree.leafIndex)
+        stop = threading.Event()
+        counts = {'proofs': 0, 'writes': 0, 'failed': 0}
+
+        def writer():
+            with quiet():
+                while not stop.is_set():
+                    tree.add('new')
+                    tree.remove(random.choice(list(tree.tree.leafIndex)))
+                    counts['writes'] += 2
+
+        def reader():
+            proofs, failed = 0, 0
+            while not stop.is_set():
+                snapshot = tree.snapshot
+                proof = tree.get_proof(random.choice(keys), snapshot)
+                if proof != None and not verify_proof(snapshot.rootHash, proof):
+                    failed += 1
+                proofs += 1
+            counts['proofs'] += proofs
+            counts['failed'] += failed
+
+        threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(readers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        print('%-8d %12.0f %12.0f %10d' % (readers, counts['proofs'] / duration,
+                                             counts['writes'] / duration, counts['failed']))
+
+
+def bench_service(appends=4096, allWindow=(0.001, 0.005)):
+    '''
+    函数功能：逐个 add 与 MerkleService 合并追加请求（不同时间窗口）的吞吐量对比
+    '''
+    async def run(window):
+        service = MerkleService(window=window)
+        start = time.perf_counter()
+        await asyncio.gather(*[service.append(str(i)) for i in range(appends)])
+        cost = time.perf_counter() - start
+        await service.close()
+        return service.stats['batches'], cost
+
+    print('%-8s %10s %12s' % ('window', 'batches', 'appends/s'))
+    with quiet():
+        tree = SnapshotMerkleTree()
+        start = time.perf_counter()
+        for i in range(appends):
+            tree.add(str(i))
+        cost = time.perf_counter() - start
+    print('%-8s %10d %12.0f' % ('add', appends, appends / cost))
+    for window in allWindow:
+        with quiet():
+            batches, cost = asyncio.run(run(window))
+        print('%-8s %10d %12.0f' % (window, batches, appends / cost))
+
+
+def bench_tree_prime(sizes=(2**16, 2**18, 2**20), limit=10):
+    '''
+    函数功能：getTreePrime() 遍历所有叶子，以及只取前 limit 个叶子的耗时
+    '''
+    print('%-10s %12s %12s' % ('leaves', 'all(s)', 'limit(s)'))
+    for size in sizes:
+        with quiet():
+            mt = MerkleTree(index='hash', raw=True)
+            mt.build_merkle_tree([str(i) for i in range(size)])
+        cost = []
+        for thisLimit in (None, limit):
+            start = time.perf_counter()
+            mt.getTreePrime(limit=thisLimit)
+            cost.append(time.perf_counter() - start)
+        print('%-10d %12.3f %12.3f' % (size, cost[0], cost[1]))
+
+
+if __name__ == '__main__':
+    bench_index_update()
+    bench_flat_build()
+    bench_parallel_build()
+    bench_verify()
+    bench_snapshot_readers()
+    bench_service()
+    bench_tree_prime()
@@ -0,0 +1,43 @@
+import FlatMerkleTree
+import io
+import os
+import pytest
+import random
+
+'''
+FlatMerkleTree 的测试：多进程构建、流式构建与单进程构建的结果完全一致
+'''
+
+
+@pytest.mark.parametrize('way', ['filling', 'imbalance'])
+def test_parallel_build(monkeypatch, way):
+    # 调小每个子进程负责的叶子数量，少量叶子也会切分成多棵子树
+    monkeypatch.setattr(FlatMerkleTree, 'MIN_CHUNK', 4)
+    generator = random.Random(way)
+    for size in (5, 17, 64, 100, 1025):
+        nodeData = [str(generator.random()) for _ in range(size)]
+        serial = FlatMerkleTree.FlatMerkleTree()
+        serial.build_merkle_tree(nodeData, way=way)
+        parallel = FlatMerkleTree.FlatMerkleTree()
+        parallel.build_merkle_tree(nodeData, way=way, workers=3)
+        assert [bytes(level) for level in parallel.levels] == [bytes(level) for level in serial.levels]
+        assert parallel.leafData == serial.leafData
+
+
+@pytest.mark.parametrize('way', ['filling', 'imbalance'])
+def test_stream_spill(tmp_path, way):
+    generator = random.Random(way)
+    for size in (1, 2, 7, 16, 33, 100):
+        nodeData = [str(generator.random()) for _ in range(size)]
+        tree = FlatMerkleTree.FlatMerkleTree()
+        tree.build_merkle_tree(nodeData, way=way)
+
+        spillDir = tmp_path / ('%s_%d' % (way, size))
+        spillDir.mkdir()
+        rootHash = FlatMerkleTree.stream_merkle_root(io.StringIO('\n'.join(nodeData) + '\n'), way=way,
+                                                     spillDir=str(spillDir))
+        assert rootHash == tree.root_hash()
+        # 写入文件的每一层与 FlatMerkleTree 的每一层逐字节相同
+        assert len(os.listdir(spillDir)) == len(tree.levels)
+        for level, digests in enumerate(tree.levels):
+            assert (spillDir / ('level_%d.bin' % level)).read_bytes() == bytes(digests)
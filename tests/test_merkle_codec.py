@@ -0,0 +1,158 @@
+from FlatMerkleTree import FlatMerkleTree
+from MerkleProof import MerkleMultiProof, MerkleProof, verify_absent, verify_leaf_value, verify_multiproof, verify_proof
+from MerkleTree import MerkleTree
+import MerkleCodec
+import pytest
+
+'''
+MerkleCodec 的往返测试：解码得到的树与原来的树根一致，由它生成的证明能用原来的树根验证，
+之后做同样的修改，两棵树的树根仍然一致
+'''
+
+
+def round_trip(obj):
+    return MerkleCodec.loads(MerkleCodec.dumps(obj))
+
+
+@pytest.mark.parametrize('way', ['filling', 'imbalance'])
+def test_flat_tree(way):
+    tree = FlatMerkleTree()
+    tree.build_merkle_tree([str(i) for i in range(37)], way=way)
+    copy = round_trip(tree)
+
+    assert copy.root_hash() == tree.root_hash()
+    assert list(copy.leafData) == list(tree.leafData)
+    for index in range(len(tree)):
+        assert verify_proof(tree.root_hash(), copy.get_proof(index))
+    assert verify_multiproof(tree.root_hash(), copy.get_multiproof([0, 5, 6, len(tree) - 1]))
+
+    for thisTree in (tree, copy):
+        thisTree.add('z')
+        thisTree.update(3, 'y')
+        thisTree.remove(7)
+    assert copy.root_hash() == tree.root_hash()
+
+
+@pytest.mark.parametrize('removed', [False, True])
+@pytest.mark.parametrize('way', ['filling', 'imbalance'])
+@pytest.mark.parametrize('raw', [False, True])
+@pytest.mark.parametrize('index', ['prime', 'hash'])
+def test_merkle_tree(index, raw, way, removed):
+    tree = MerkleTree(index=index, raw=raw)
+    tree.build_merkle_tree([str(i) for i in range(23)], way=way)
+    if removed:
+        keys = tree.getTreePrime()
+        tree.remove(keys[1])
+        tree.remove(keys[-3])
+    copy = round_trip(tree)
+
+    assert copy.root_hash() == tree.root_hash()
+    keys = tree.getTreePrime()
+    assert copy.getTreePrime() == keys
+    for key in keys:
+        assert verify_proof(tree.root_hash(), copy.get_proof(key))
+    assert verify_multiproof(tree.root_hash(), copy.get_multiproof(keys[:3] + keys[-2:]))
+
+    # 之后的修改要得到相同的树根（叶子标号、hash 值不能依赖解码时重新分配的内容）
+    for thisTree in (tree, copy):
+        thisTree.add('z')
+    assert copy.root_hash() == tree.root_hash()
+    for thisTree in (tree, copy):
+        thisTree.extend(['x', 'w'])
+        thisTree.update(keys[0], 'v')
+        thisTree.remove(keys[2])
+    assert copy.root_hash() == tree.root_hash()
+
+
+def test_empty_merkle_tree():
+    tree = MerkleTree(index='hash')
+    copy = round_trip(tree)
+    assert copy.root_hash() == None
+    for thisTree in (tree, copy):
+        thisTree.add('a')
+    assert copy.root_hash() == tree.root_hash()
+
+
+@pytest.mark.parametrize('raw', [False, True])
+def test_proof(raw):
+    tree = MerkleTree(index='hash', raw=raw)
+    tree.build_merkle_tree([str(i) for i in range(11)], way='imbalance')
+    for key in tree.getTreePrime():
+        proof = tree.get_proof(key)
+        copy = round_trip(proof)
+        assert isinstance(copy, MerkleProof)
+        assert (copy.leafHash, copy.path, copy.index, copy.treeSize, copy.raw) == \
+            (proof.leafHash, proof.path, proof.index, proof.treeSize, proof.raw)
+        assert verify_proof(tree.root_hash(), copy)
+
+
+@pytest.mark.parametrize('raw', [False, True])
+def test_proof_leaf(raw):
+    tree = MerkleTree(index='hash', raw=raw)
+    tree.build_merkle_tree(['10', '15', '20', '40'], way='imbalance')
+    key = tree.getTreePrime()[1]
+    proof = tree.get_proof(key)
+    proof.leafValue, proof.leafKey = '15', key
+    copy = round_trip(proof)
+    assert copy.leafValue == '15' and copy.leafKey == key and verify_leaf_value(copy)
+    assert verify_proof(tree.root_hash(), copy)
+
+
+@pytest.mark.parametrize('raw', [False, True])
+def test_sorted_tree(raw):
+    tree = MerkleTree(index='hash', raw=raw)
+    tree.build_merkle_tree(['40', '10', '20', '15', '20'], way='imbalance', sorted=True)
+    copy = round_trip(tree)
+    assert copy.sorted and copy.root_hash() == tree.root_hash()
+    assert verify_absent(tree.root_hash(), copy.prove_absent('17'))
+    assert copy.prove_absent('20') == None
+    for thisTree in (tree, copy):
+        thisTree.add('17')
+    assert copy.root_hash() == tree.root_hash()
+
+
+def test_flat_proof():
+    tree = FlatMerkleTree()
+    tree.build_merkle_tree([str(i) for i in range(13)], way='imbalance')
+    copy = round_trip(tree.get_proof(12))
+    assert verify_proof(tree.root_hash(), copy)
+
+
+@pytest.mark.parametrize('raw', [False, True])
+def test_multiproof(raw):
+    tree = MerkleTree(index='hash', raw=raw)
+    tree.build_merkle_tree([str(i) for i in range(19)], way='imbalance')
+    keys = tree.getTreePrime()
+    proof = tree.get_multiproof(keys[2:9])
+    copy = round_trip(proof)
+    assert isinstance(copy, MerkleMultiProof)
+    assert (copy.leaves, copy.siblings, copy.depth, copy.treeSize) == \
+        (proof.leaves, proof.siblings, proof.depth, proof.treeSize)
+    assert verify_multiproof(tree.root_hash(), copy)
+
+    flat = FlatMerkleTree()
+    flat.build_merkle_tree([str(i) for i in range(19)], way='imbalance')
+    assert verify_multiproof(flat.root_hash(), round_trip(flat.get_multiproof([0, 1, 10, 18])))
+
+
+@pytest.mark.parametrize('way', ['filling', 'imbalance'])
+def test_tampered_leaf(way):
+    tree = MerkleTree(index='hash')
+    tree.build_merkle_tree(['alpha', 'bravo', 'charlie', 'delta', 'echo'], way=way)
+    data = MerkleCodec.dumps(tree)
+    assert MerkleCodec.loads(data).root_hash() == tree.root_hash()
+    # 只改叶子数据、不改 hash 值，树根仍然一致，要靠逐个核对叶子发现
+    with pytest.raises(ValueError):
+        MerkleCodec.loads(data.replace(b'bravo', b'brave'))
+
+
+def test_persistent_tree():
+    tree = MerkleTree(index='hash', persistent=True)
+    tree.build_merkle_tree([str(i) for i in range(9)], way='imbalance')
+    tree.add('a')
+    copy = round_trip(tree)
+    assert copy.persistent and list(copy.versions) == [tree.history]
+    for thisTree in (tree, copy):
+        thisTree.update(thisTree.getTreePrime()[0], 'b')
+    assert copy.root_hash() == tree.root_hash()
+    assert copy.root_hash(tree.history - 1) == tree.root_hash(tree.history - 1)
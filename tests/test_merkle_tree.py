@@ -0,0 +1,180 @@
+from MerkleProof import verify_absent, verify_multiproof, verify_proof
+from MerkleSnapshot import SnapshotMerkleTree
+from MerkleTree import MerkleTree, iter_leaves
+from collections import Counter
+import math
+import pytest
+import random
+
+'''
+MerkleTree 的测试
+'''
+
+
+def check_tree(tree):
+    '''
+    函数功能：检查整棵树的结构：hash 值、childNum、父亲指针、所有叶子在同一深度、树高最小、叶子字典、值索引
+    '''
+    if len(tree.leafIndex) == 0:
+        assert tree.root.childNum == 0 and tree.root_hash() == None
+        return
+
+    def walk(node, depth):
+        if node.depth == 0:
+            assert tree.leafIndex[str(node.primeNum)] is node
+            return [depth]
+        children = [child for child in (node.leftNode, node.rightNode) if child]
+        assert children and all(child.father is node and child.depth == node.depth - 1 for child in children)
+        merged = (node.leftNode.hash if node.leftNode else tree.emptyHash) + \
+            (node.rightNode.hash if node.rightNode else tree.emptyHash)
+        assert node.hash == tree.calculate_hash(merged)
+        depths = [leafDepth for child in children for leafDepth in walk(child, depth + 1)]
+        assert node.childNum == len(depths)
+        return depths
+
+    depths = walk(tree.root, 0)
+    assert len(set(depths)) == 1 and len(depths) == len(tree.leafIndex)
+    assert tree.root.depth == max(1, math.ceil(math.log2(len(depths))))
+    if tree.sorted:
+        counts = Counter(str(int(leaf.value)) for leaf in iter_leaves(tree.root))
+        assert dict(counts) == {key: int(count) for key, count in tree.valueIndex.leaves.values()}
+
+
+def check_proofs(tree):
+    rootHash = tree.root_hash()
+    keys = tree.getTreePrime()
+    for key in keys:
+        assert verify_proof(rootHash, tree.get_proof(key))
+    if keys:
+        assert verify_multiproof(rootHash, tree.get_multiproof(keys[:2] + keys[-1:]))
+
+
+@pytest.mark.parametrize('raw', [False, True])
+@pytest.mark.parametrize('way', ['filling', 'imbalance'])
+def test_sorted_absence(way, raw):
+    tree = MerkleTree(index='hash', raw=raw)
+    tree.build_merkle_tree(['10', '15', '20', '40', '20'], way=way, sorted=True)
+    check_proofs(tree)
+    for value in ('5', '17', '41'):
+        assert verify_absent(tree.root_hash(), tree.prove_absent(value))
+    for value in ('10', '20', '40'):
+        assert tree.prove_absent(value) == None
+
+    # 证明只对生成时的树根有效
+    proof = tree.prove_absent('17')
+    key = tree.add('17')
+    assert tree.prove_absent('17') == None
+    assert not verify_absent(tree.root_hash(), proof)
+
+    # 有多个 '20'（filling 方式还有补齐的副本），全部删掉之后才能证明不在
+    twenty = [key for key in tree.getTreePrime() if tree.leafIndex[key].value == '20']
+    for key20 in twenty:
+        assert tree.prove_absent('20') == None
+        tree.remove(key20)
+    tree.update(key, '16')
+    check_proofs(tree)
+    for value in ('17', '20'):
+        assert verify_absent(tree.root_hash(), tree.prove_absent(value))
+    assert tree.prove_absent('16') == None
+
+
+def test_sorted_positions():
+    # 叶子按添加的顺序排列，与其它叶子的值无关
+    tree = MerkleTree(index='hash')
+    tree.build_merkle_tree(['30', '20'], way='imbalance', sorted=True)
+    tree.add('10')
+    tree.extend(['5', '25'])
+    assert [tree.leafIndex[key].value for key in tree.getTreePrime()] == ['30', '20', '10', '5', '25']
+
+    rootHash, keys = tree.root_hash(), tree.getTreePrime()
+    for bad in (['1', 'x'], ['2', None]):
+        with pytest.raises(Exception):
+            tree.extend(bad)
+    assert tree.root_hash() == rootHash and tree.getTreePrime() == keys
+    assert verify_absent(rootHash, tree.prove_absent('1'))
+
+
+def test_sorted_versions():
+    tree = MerkleTree(index='hash', persistent=True)
+    tree.build_merkle_tree(['1', '2', '3'], way='imbalance', sorted=True)
+    old = tree.history
+    key = tree.add('4')
+    assert verify_proof(tree.root_hash(old), tree.get_proof(tree.getTreePrime()[0], version=old))
+    assert verify_proof(tree.root_hash(), tree.get_proof(key))
+    assert tree.root_hash(old) != tree.root_hash()
+
+    snapshots = SnapshotMerkleTree()
+    snapshots.build_merkle_tree(['1', '2', '3'], sorted=True)
+    snapshot = snapshots.snapshot
+    snapshots.add('4')
+    for key in ('1', '2', '3'):
+        assert verify_proof(snapshot.rootHash, snapshots.get_proof(key, snapshot))
+
+
+@pytest.mark.parametrize('index', ['prime', 'hash'])
+def test_version_proofs_after_remove(index):
+    # 删除会把最后一个叶子搬到空位上，历史版本要按当时的位置找到叶子
+    tree = MerkleTree(index=index, persistent=True)
+    tree.build_merkle_tree([str(i) for i in range(11)], way='imbalance')
+    first = tree.history
+    keys = tree.getTreePrime()
+    tree.remove(keys[2])
+    tree.remove(keys[0])
+    tree.add('x')
+    tree.remove(keys[5])
+    for version in tree.versions:
+        rootHash = tree.root_hash(version)
+        present = [leaf.primeNum for leaf in iter_leaves(tree.versions[version])]
+        for key in set(keys) | set(tree.leafIndex):
+            proof = tree.get_proof(key, version=version)
+            assert (proof != None) == (key in present)
+            assert proof == None or verify_proof(rootHash, proof)
+
+    tree.prune(first + 2)
+    assert verify_proof(tree.root_hash(first + 2), tree.get_proof(keys[10], version=first + 2))
+
+
+def test_old_snapshot_proofs():
+    snapshots = SnapshotMerkleTree()
+    snapshots.build_merkle_tree([str(i) for i in range(20)])
+    snapshot = snapshots.snapshot
+    keys = snapshots.tree.getTreePrime()
+    for key in keys[:8]:
+        snapshots.remove(key)
+    for key in keys:
+        assert verify_proof(snapshot.rootHash, snapshots.get_proof(key, snapshot))
+    assert snapshots.get_proof(keys[0]) == None
+
+    # 旧快照不再被持有之后，对应的删除记录随之丢弃
+    del snapshot
+    snapshots.add('x')
+    assert len(snapshots.tree.removedLeaves) == 0
+
+
+@pytest.mark.parametrize('sorted', [False, True])
+@pytest.mark.parametrize('persistent', [False, True])
+@pytest.mark.parametrize('raw', [False, True])
+@pytest.mark.parametrize('index', ['prime', 'hash'])
+def test_random_updates(index, raw, persistent, sorted):
+    # 随机的添加、修改、删除之后，树的结构和证明始终正确
+    generator = random.Random(index + str(raw) + str(persistent) + str(sorted))
+    for trial in range(6):
+        tree = MerkleTree(index=index, raw=raw, persistent=persistent)
+        tree.build_merkle_tree([str(generator.randint(0, 99)) for _ in range(generator.randint(1, 40))],
+                               way=generator.choice(['filling', 'imbalance']), sorted=sorted)
+        for _ in range(60):
+            action = generator.random()
+            if action < 0.45 and tree.leafIndex:
+                tree.remove(generator.choice(list(tree.leafIndex)))
+            elif action < 0.6 and tree.leafIndex:
+                tree.update(generator.choice(list(tree.leafIndex)), str(generator.randint(0, 99)))
+            elif action < 0.7:
+                tree.extend([str(generator.randint(0, 99)) for _ in range(generator.randint(1, 5))])
+            else:
+                tree.add(str(generator.randint(0, 99)))
+            check_tree(tree)
+            check_proofs(tree)
+            if sorted and tree.leafIndex:
+                value = str(generator.randint(0, 99))
+                proof = tree.prove_absent(value)
+                assert proof == None or verify_absent(tree.root_hash(), proof)